@@ -1,26 +1,54 @@
+import threading
+from os import path
+
 import pandas as pd
 import numpy as np
-from functools import reduce
-
-from PortfolioBasic.stockstats import StockDataFrame
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
 
-from MarketData import QuandlMarketDataSource, MarketData
+from MarketData import QuandlMarketDataSource, BloombergMarketDataSource, MarketData, index_time, align_frames
+from SentimentData import DailySentiment
+from utilities.Artifacts import ArtifactSink
 from PortfolioBasic.Definitions import HeaderFactory
-from PortfolioBasic.Technical.Indicators import RsiIndicator, MomentumIndicator, MACDIndicator,  \
+from PortfolioBasic.Instrumentation import tracer
+from PortfolioBasic.Technical.Cache import IndicatorCache
+from PortfolioBasic.Technical.Indicators import Indicator, RsiIndicator, MomentumIndicator, MACDIndicator,  \
     CombinedIndicator, BollingerIndicator, Williams, CommodityChannelIndex, TripleExponentialMovingAverage, \
-    AverageDirectionalIndex, AverageTrueRange
+    AverageDirectionalIndex, AverageTrueRange, CachedIndicator, BetaIndicator
 
 
 class DataLoader(object):
 
+    # extra rows for EMA based indicators to forget their starting values
+    CONVERGENCE_DAYS = 250
+
+    def __init__(self, cache: IndicatorCache = None, convergence_days: int = CONVERGENCE_DAYS,
+                 sink: ArtifactSink = None):
+        self.cache = cache
+        # debug dumps of the intermediate frames, nothing is written by default
+        self.sink = ArtifactSink() if sink is None else sink
+        self.convergence_days = convergence_days
+        self._sentiment = {}
+        self._sentiment_lock = threading.Lock()
+
+    @tracer.traced('DataLoader.load_data')
     def load_data(self, stock, days, sentiment_location=None, source=QuandlMarketDataSource(), full_articles=True,
-                  from_date='2011-04-01', to_date='2015-04-01'):
+                  from_date='2011-04-01', to_date='2015-04-01', horizons=None, thresholds=None, benchmark=None,
+                  beta_window=60):
+        """Features and labels of `stock`, see `MarketData.get_feature_data` for `horizons`.
+
+        With a `benchmark` ticker of the same source (e.g. 'SPY EQUITY') the rolling beta and
+        correlation of the returns against it are added as features.
+        """
         articles = None
         if sentiment_location is not None:
             articles = self.load_sentiment(sentiment_location, full_articles)
-        price_df = source.get_stock_data(stock)
+        extra = []
+        if benchmark is not None:
+            benchmark_df = source.get_stock_data(benchmark, from_date=self.get_warmup_start(from_date, beta_window + 1),
+                                                 to_date=to_date)
+            extra.append(BetaIndicator(benchmark_df[HeaderFactory.Price], beta_window))
         # noinspection PyTypeChecker
-        indicators = CombinedIndicator((
+        indicators = self.create_indicator((
             MomentumIndicator(1),
             MomentumIndicator(5),
             BollingerIndicator(),
@@ -31,92 +59,172 @@ class DataLoader(object):
             AverageTrueRange(),
             RsiIndicator(),
             Williams()
-            ))
+            ) + tuple(extra))
         ma = [
             50,
             100,
             200
         ]
 
-        market = MarketData(stock, price_df, days=days, ma=ma, indicator=indicators, df_additional=articles)
-        price_df = market.get_stock_data()
-        return market.get_binary_data(price_df, days=days, from_date=from_date, to_date=to_date)
-
-    def load_sentiment(self, location, full_articles=True):
-        articles = pd.read_csv(location, na_values=["nan"])
-
-        articles.Date = pd.to_datetime(articles.Date, format='%d/%m/%Y %H:%M:%S')
-        articles.set_index('Date', inplace=True)
-        articles.reindex()
-        articles.sort_index(ascending=True, inplace=True)
-
-        if full_articles:
-            articles['Anger'] /= articles['TotalWords']
-            articles['Anticipation'] /= articles['TotalWords']
-            articles['Disgust'] /= articles['TotalWords']
-            articles['Fear'] /= articles['TotalWords']
-            articles['Joy'] /= articles['TotalWords']
-            articles['Sadness'] /= articles['TotalWords']
-            articles['Surprise'] /= articles['TotalWords']
-            articles['Trust'] /= articles['TotalWords']
-            articles.drop(columns=['Original', 'Original', 'TotalWords', 'TotalSentimentWords', 'Id'], inplace=True)
+        # only load and compute the history the features actually need
+        warmup = max([indicators.warmup_days(self.convergence_days)] + ma)
+        price_df = source.get_stock_data(stock, from_date=self.get_warmup_start(from_date, warmup), to_date=to_date)
+        price_df = self.select_range(price_df, from_date, to_date, warmup)
+
+        market = MarketData(stock, price_df, days=days, ma=ma, indicator=indicators, df_additional=articles,
+                            sink=self.sink)
+        return market.get_feature_data(days=days, from_date=from_date, to_date=to_date, horizons=horizons,
+                                       thresholds=thresholds)
+
+    def load_many(self, tickers, days, sentiment_location=None, source=QuandlMarketDataSource(), full_articles=True,
+                  from_date='2011-04-01', to_date='2015-04-01', horizons=None, thresholds=None, benchmark=None,
+                  beta_window=60, workers=4, max_in_flight=None, processes=False):
+        """Load several tickers concurrently, yielding (ticker, x, y) as each one completes.
+
+        `sentiment_location` is either one file for all tickers or a {ticker: file} dict. At most
+        `max_in_flight` tickers (default `workers`) are being loaded or held by the consumer at any
+        time, which bounds the memory of the results. `processes` switches from threads to processes, each
+        process builds its own loader from `config()` and `source` must be picklable. Artifacts are
+        not written from the worker processes.
+        """
+        max_in_flight = max(1, max_in_flight or workers)
+        if processes:
+            executor = ProcessPoolExecutor(max_workers=workers, initializer=_start_worker, initargs=(self.config(),))
+            load = _load_in_worker
         else:
-            articles.drop(columns=['Original', 'Original', 'TotalWords', 'TotalSentimentWords', 'Id', 'Anger',
-                                   'Anticipation', 'Disgust', 'Fear', 'Joy', 'Sadness', 'Surprise', 'Trust'], inplace=True)
-        articles['Calculated'] = ((articles['Calculated'] - 1) / 2) - 1
-        articles = articles.groupby(pd.TimeGrouper('D')).mean()
-        articles.to_csv('articles.csv')
+            executor = ThreadPoolExecutor(max_workers=workers)
+            load = self.load_data
+        pending = iter(tickers)
+        with executor:
+            running = {}
+
+            def submit():
+                try:
+                    ticker = next(pending)
+                except StopIteration:
+                    return False
+                location = sentiment_location
+                if isinstance(sentiment_location, dict):
+                    location = sentiment_location.get(ticker)
+                future = executor.submit(load, ticker, days, sentiment_location=location, source=source,
+                                         full_articles=full_articles, from_date=from_date, to_date=to_date,
+                                         horizons=horizons, thresholds=thresholds, benchmark=benchmark,
+                                         beta_window=beta_window)
+                running[future] = ticker
+                return True
+
+            while len(running) < max_in_flight and submit():
+                pass
+            while running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ticker = running.pop(future)
+                    x_data, y_data = future.result()
+                    yield ticker, x_data, y_data
+                    # the next ticker starts once the consumer asks for more
+                    submit()
+
+    def config(self) -> dict:
+        """Picklable settings to build an equivalent loader in another process, see `from_config`."""
+        cache = None
+        if self.cache is not None:
+            cache = {'location': self.cache.location, 'max_bytes': self.cache.max_bytes}
+        return {'cache': cache, 'convergence_days': self.convergence_days}
+
+    @staticmethod
+    def from_config(config: dict):
+        cache = None
+        if config['cache'] is not None:
+            cache = IndicatorCache(**config['cache'])
+        return DataLoader(cache, convergence_days=config['convergence_days'])
+
+    def create_indicator(self, indicators) -> Indicator:
+        """Combine `indicators` so they share one stockstats evaluation, served from the cache if set."""
+        indicator = CombinedIndicator(indicators)
+        if self.cache is not None:
+            indicator = CachedIndicator(indicator, self.cache)
+        return indicator
+
+    @staticmethod
+    def get_warmup_start(from_date, warmup: int) -> pd.Timestamp:
+        """Calendar date safely before the `warmup` trading days preceding from_date."""
+        return pd.Timestamp(from_date) - pd.tseries.offsets.BDay(warmup + warmup // 20 + 5)
+
+    @staticmethod
+    def select_range(price_df: pd.DataFrame, from_date, to_date, warmup: int) -> pd.DataFrame:
+        """Keep `warmup` rows before from_date and nothing after to_date."""
+        first = max(0, price_df.index.searchsorted(index_time(from_date, price_df.index)) - warmup)
+        last = price_df.index.searchsorted(index_time(to_date, price_df.index), side='right')
+        return price_df.iloc[first:last]
+
+    @tracer.traced('DataLoader.load_sentiment')
+    def load_sentiment(self, location, full_articles=True):
+        """Daily mean sentiment of the articles in `location`.
+
+        The aggregation is kept between calls, only articles appended to the file since the
+        previous call are read.
+        """
+        key = (path.abspath(location), full_articles)
+        with self._sentiment_lock:
+            sentiment = self._sentiment.get(key)
+            if sentiment is None:
+                sentiment = self._sentiment[key] = DailySentiment(location, full_articles)
+        sentiment.update()
+        articles = sentiment.means()
+        self.sink.write('articles', articles)
         return articles
 
-    def load(self, days: int = 5, include_articles: bool=True):
-
-        market_data = self.load_bloomber()
-        market_data.sort_index(inplace=True)
-        prices = pd.DataFrame(market_data[HeaderFactory.Price])
+    @tracer.traced('DataLoader.load')
+    def load(self, stock: str, days: int = 5, include_articles: bool = True, source=BloombergMarketDataSource(),
+             sentiment_location=None, full_articles=True, from_date='2011-04-01', to_date='2015-04-01'):
+        """Legacy feature set: price, articles, MACD, momentum, RSI and Williams %R.
 
+        The rows are the trading days of `stock`. Articles are left joined onto them, as the
+        former `prices.join(articles)`, so days with articles but no prices are not rows. The
+        blocks are then aligned in one pass, see `align_frames`.
+        """
+        articles = None
         if include_articles:
-            articles = self.load_sentiment()
-            prices = prices.join(articles)
-
-        rsi_indicator = RsiIndicator()
-        rsi = rsi_indicator.calculate(market_data)
-
-        momentum_indicator = MomentumIndicator(1)
-        momentum = momentum_indicator.calculate(market_data)
-
-        momentum_indicator_5 = MomentumIndicator(5)
-        momentum_5 = momentum_indicator_5.calculate(market_data)
-        momentum_5 = momentum_5.rename(columns={"MOM": "MOM_5"})
-
-        stock = StockDataFrame.retype(market_data.copy())
-        wr_10 = stock['wr_10']
-        wr_10 = pd.DataFrame(index=wr_10.index, data=wr_10.values, columns=['wr_10'])
-
-        macd_indicator = MACDIndicator()
-        macd = macd_indicator.calculate(market_data)
-        macd_diff = pd.DataFrame(macd[HeaderFactory.MACD_DIFF])
-        macd_x = pd.DataFrame(macd[HeaderFactory.MACD])
-        macd_sig = pd.DataFrame(macd[HeaderFactory.MACD_SIGNAL])
-
-        y_data = pd.DataFrame(market_data[HeaderFactory.Price])
-        y_data['y'] = np.where(y_data.shift(-days) < y_data, 0, 1)
-        y_data.drop(columns=[HeaderFactory.Price], inplace=True)
-
-        data_frames = [
-            prices,
-            macd_diff,
-            macd_x,
-            macd_sig,
-            momentum,
-            momentum_5,
-            rsi,
-            wr_10,
-            y_data]
-        df_merged = reduce(lambda left, right: pd.merge(left, right, left_index=True, right_index=True, how='outer'),
-                           data_frames)
-        df_merged.fillna(value=0, inplace=True)
-        df_merged = df_merged.ix['2011-04-01': '2015-04-01'].copy()
-        df_merged.to_csv('result.csv')
-        x_data = df_merged.iloc[1:-days, 1:-1].values
-        y_data = df_merged.iloc[1:-days, -1].values
-        return x_data, y_data
\ No newline at end of file
+            if sentiment_location is None:
+                raise ValueError("sentiment_location is required to include articles")
+            articles = self.load_sentiment(sentiment_location, full_articles)
+
+        # noinspection PyTypeChecker
+        indicators = self.create_indicator((
+            MACDIndicator(),
+            MomentumIndicator(1),
+            MomentumIndicator(5),
+            RsiIndicator(),
+            Williams()
+            ))
+        warmup = indicators.warmup_days(self.convergence_days)
+        market_data = source.get_stock_data(stock, from_date=self.get_warmup_start(from_date, warmup), to_date=to_date)
+        market_data = self.select_range(market_data, from_date, to_date, warmup)
+
+        price = market_data[HeaderFactory.Price]
+        signal = indicators.calculate(market_data)
+        signal = signal[[HeaderFactory.MACD_DIFF, HeaderFactory.MACD, HeaderFactory.MACD_SIGNAL, 'MOM_1', 'MOM_5',
+                         HeaderFactory.RSI, 'wr_10']]
+        y_data = pd.DataFrame({'y': np.where(price.shift(-days) < price, 0, 1)}, index=market_data.index)
+        blocks = [price.to_frame(), signal, y_data]
+        if articles is not None:
+            blocks.insert(1, articles.reindex(market_data.index))
+
+        matrix, index, columns = align_frames(blocks, from_date, to_date)
+        self.sink.write('result', lambda: pd.DataFrame(matrix, index=index, columns=columns))
+        x_data = matrix[1:-days, 1:-1]
+        y_data = matrix[1:-days, -1]
+        return x_data, y_data
+
+
+# loader of a load_many worker process, kept so its sentiment aggregations are reused
+_worker_loader = None
+
+
+def _start_worker(config: dict):
+    global _worker_loader
+    _worker_loader = DataLoader.from_config(config)
+
+
+def _load_in_worker(stock, days, **kwargs):
+    return _worker_loader.load_data(stock, days, **kwargs)
@@ -1,28 +1,43 @@
+import time
+
+STARTED = time.perf_counter()
+
+import argparse
+import importlib
 import logging.config
-from sklearn.utils import shuffle
+import sys
 
 import numpy as np
-from os import path
-import quandl
-from keras.layers import LSTM, Dropout, Dense, Activation
-from keras import Sequential, callbacks
-from keras.layers import Conv1D, MaxPooling1D
-from keras.optimizers import RMSprop
-from sklearn import preprocessing
-from sklearn.model_selection import train_test_split
-from sklearn.pipeline import Pipeline
 from DataLoader import DataLoader
 from MarketData import QuandlMarketDataSource, RedditMarketDataSource, BloombergMarketDataSource
+from PortfolioBasic.Instrumentation import tracer
+from PortfolioBasic.Technical.Cache import IndicatorCache
 
-from learning.BasicLearning import RbfClassifier
-from utilities import Constants
+from utilities import Constants, logger
 from utilities.Utilities import Utilities
 
-logging.config.fileConfig('logging.conf', disable_existing_loggers=False)
-quandl.ApiConfig.api_key = '__YOUR_KEY__'
+IMPORTED = time.perf_counter()
+
+MODELS = ['SVM', 'Basic_LSTM', 'Conv', 'LSTM']
+SOURCES = ['quandl', 'reddit', 'bloomberg']
+
+
+def load_module(name: str):
+    """Import `name` when a code path first needs it and report how long that took."""
+    if name in sys.modules:
+        return sys.modules[name]
+    start = time.perf_counter()
+    with tracer.span('import', module=name):
+        module = importlib.import_module(name)
+    logger.info("Imported %s in %.2fs", name, time.perf_counter() - start)
+    return module
 
 
 def build_model(inputs, model_type):
+    load_module('keras')
+    from keras import Sequential
+    from keras.layers import LSTM, Dropout, Dense, Activation, Conv1D, MaxPooling1D
+    from keras.optimizers import RMSprop
 
     model = Sequential()
     if model_type == 'Basic_LSTM':
@@ -52,8 +67,8 @@ def build_model(inputs, model_type):
     return model
 
 
-def get_data(full_articles, sentiment_location, price_source, stock):
-    loader = DataLoader()
+def get_data(full_articles, sentiment_location, price_source, stock, from_date='2011-04-01', to_date='2015-04-01'):
+    loader = DataLoader(IndicatorCache(Constants.INDICATOR_CACHE))
     if price_source == 'quandl':
         source = QuandlMarketDataSource()
     elif price_source == 'reddit':
@@ -64,14 +79,17 @@ def get_data(full_articles, sentiment_location, price_source, stock):
                                       source=source,
                                       sentiment_location=sentiment_location,
                                       full_articles=full_articles,
-                                      from_date='2011-04-01', to_date='2015-04-01')
-    scaler = preprocessing.StandardScaler()
-    scaler.fit(x_data)
-    x_data = scaler.transform(x_data)
+                                      from_date=from_date, to_date=to_date)
+    preprocessing = load_module('sklearn.preprocessing')
+    with tracer.span('StandardScaler', rows=len(x_data)):
+        scaler = preprocessing.StandardScaler()
+        scaler.fit(x_data)
+        x_data = scaler.transform(x_data)
     return x_data, y_data
 
 
 def lstm_prediction(model_type, x_train, x_test, y_train):
+    callbacks = load_module('keras.callbacks')
 
     y_train = Utilities.make_dual(y_train, 2)
     x_train = np.reshape(x_train, (x_train.shape[0], x_train.shape[1], 1))
@@ -83,25 +101,36 @@ def lstm_prediction(model_type, x_train, x_test, y_train):
     # train model on data
     # note: eth_history contains information on the training error per epoch
     cbks = [callbacks.EarlyStopping(monitor='val_loss', patience=25)]
-    market_model.fit(x_train, y_train, batch_size=1000, callbacks=cbks, epochs=50, validation_split=0.25, shuffle=True)
-    y_result_prob = market_model.predict(x_test)
+    with tracer.span('keras.fit', model=model_type, rows=len(x_train)):
+        market_model.fit(x_train, y_train, batch_size=1000, callbacks=cbks, epochs=50, validation_split=0.25,
+                         shuffle=True)
+    with tracer.span('keras.predict', model=model_type, rows=len(x_test)):
+        y_result_prob = market_model.predict(x_test)
     y_result = Utilities.make_single_dimension(y_result_prob)
     return y_result, y_result_prob
 
 
 def svm_prediction(x_train, x_test, y_train):
+    load_module('sklearn.svm')
+    from sklearn.pipeline import Pipeline
+    from learning.BasicLearning import RbfClassifier
+
     pipeline = Pipeline([
         ['clf', RbfClassifier()]])
     pipeline.fit(x_train, y_train)
-    y_result = pipeline.predict(x_test)
-    y_result_prob = pipeline.predict_proba(x_test)
+    with tracer.span('svm.predict', rows=len(x_test)):
+        y_result = pipeline.predict(x_test)
+        y_result_prob = pipeline.predict_proba(x_test)
     return y_result, y_result_prob
 
 
-def processing(price_source, stock, load_articles, full_articles, processing_type='SVM'):
-
-    x_data, y_data = get_data(full_articles, load_articles, price_source, stock)
-    x_train, x_test, y_train, y_test = train_test_split(x_data, y_data, test_size=0.25, random_state=42)
+@tracer.traced('processing')
+def processing(price_source, stock, load_articles, full_articles, processing_type='SVM', from_date='2011-04-01',
+               to_date='2015-04-01'):
+    x_data, y_data = get_data(full_articles, load_articles, price_source, stock, from_date, to_date)
+    model_selection = load_module('sklearn.model_selection')
+    x_train, x_test, y_train, y_test = model_selection.train_test_split(x_data, y_data, test_size=0.25,
+                                                                        random_state=42)
 
     if processing_type == 'SVM':
         y_result, y_result_prob = svm_prediction(x_train, x_test, y_train)
@@ -112,21 +141,37 @@ def processing(price_source, stock, load_articles, full_articles, processing_typ
     Utilities.measure_performance_auc(y_test, y_result, y_result)
 
 
-if __name__ == '__main__':
-    item = 'JPM'
-    price_source = 'quandl'
-    processing_type = 'SVM'
-    sentiment_location = path.join(Constants.DATASETS_MARKET, 'Twitter/psenti.csv')
-    # technical analysis
-    processing(price_source, item, None, False, processing_type)
-    # technical analysis + Sentiment
-    sentiment_location = path.join(Constants.DATASETS_MARKET, 'FinArticles/psenti/all.results.csv')
-    processing(price_source, item, sentiment_location, False, processing_type)
-    sentiment_location = path.join(Constants.DATASETS_MARKET, 'FinArticles/psenti/reddit.results.csv')
-    processing(price_source, item, sentiment_location, False, processing_type)
-    # technical analysis + Sentiment + Mood
-    processing(price_source, item, sentiment_location, True, processing_type)
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Predict price direction from technical indicators and sentiment.')
+    parser.add_argument('--ticker', default='JPM', help='ticker, for bloomberg the file name, e.g. "JPM EQUITY"')
+    parser.add_argument('--source', choices=SOURCES, default='quandl', help='price source')
+    parser.add_argument('--sentiment', help='article sentiment results file, technical analysis only if omitted')
+    parser.add_argument('--full-articles', action='store_true', help='add the emotion (mood) columns')
+    parser.add_argument('--model', choices=MODELS, default='SVM', help='classifier')
+    parser.add_argument('--from', dest='from_date', default='2011-04-01', help='first date')
+    parser.add_argument('--to', dest='to_date', default='2015-04-01', help='last date')
+    parser.add_argument('--api-key', help='Quandl API key')
+    parser.add_argument('--trace', help='write a Chrome trace of the run to this file')
+    parser.add_argument('--memory', action='store_true', help='track memory per stage in the trace')
+    return parser.parse_args(argv)
+
 
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    logging.config.fileConfig('logging.conf', disable_existing_loggers=False)
+    logger.info("Started in %.2fs, imports took %.2fs", time.perf_counter() - STARTED, IMPORTED - STARTED)
+    if arguments.trace:
+        tracer.enable(memory=arguments.memory)
+    if arguments.source == 'quandl':
+        load_module('quandl').ApiConfig.api_key = arguments.api_key or '__YOUR_KEY__'
 
+    processing(arguments.source, arguments.ticker, arguments.sentiment, arguments.full_articles, arguments.model,
+               arguments.from_date, arguments.to_date)
 
+    if arguments.trace:
+        logger.info('\n%s', tracer.report())
+        tracer.export_chrome(arguments.trace)
 
+
+if __name__ == '__main__':
+    main()
@@ -1,15 +1,17 @@
 import numpy as np
-import quandl
 import pandas as pd
 from os import path
 
 from PortfolioBasic.Definitions import HeaderFactory
+from PortfolioBasic.Instrumentation import tracer
 from utilities import Constants, logger
+from utilities.Artifacts import ArtifactSink
+from utilities.FrameCache import FrameCache
 
 
 class MarketData(object):
 
-    def __init__(self, stock_name, df, ma=[], days=5, indicator=None, df_additional=None):
+    def __init__(self, stock_name, df, ma=[], days=5, indicator=None, df_additional=None, sink: ArtifactSink = None):
         self.scalers = {}
         self.stock_name = stock_name,
         self.df = df
@@ -17,13 +19,25 @@ class MarketData(object):
         self.indicator = indicator
         self.df_additional = df_additional
         self.days = days
+        self.sink = ArtifactSink() if sink is None else sink
 
-    def get_binary_data(self, df, days=5, from_date='2014-04-01', to_date='2015-04-01'):
+    @tracer.traced('MarketData.get_binary_data')
+    def get_binary_data(self, df, days=5, from_date='2014-04-01', to_date='2015-04-01', horizons=None,
+                        thresholds=None):
+        """Features and labels of the rows between the dates.
 
-        df = df.ix[from_date:to_date].copy()
-        df_full = pd.merge(df, self.df.ix[from_date:to_date], left_index=True, right_index=True, how='outer')
-        df_full.to_csv('result.csv')
+        With `horizons` the labels are a (horizons x rows) matrix from `get_labels` instead of the
+        `Direction` column, and the rows are trimmed to the longest horizon.
+        """
+        df = select_dates(df, from_date, to_date).copy()
+        self.sink.write('result', lambda: pd.merge(df, select_dates(self.df, from_date, to_date),
+                                                   left_index=True, right_index=True, how='outer'))
         y_data_df = df['Direction'].copy()
+        if horizons is not None:
+            days = max(horizons)
+            labels = self.get_labels(self.df[HeaderFactory.Price], horizons, thresholds)
+            y_data_df = pd.DataFrame(labels.T, index=self.df.index,
+                                     columns=['y_{}'.format(horizon) for horizon in horizons]).reindex(df.index)
         # df.drop(labels=[HeaderFactory.Price], axis=1, inplace=True)
         df.drop(labels=['Direction',
                         'Open',
@@ -35,11 +49,110 @@ class MarketData(object):
 
         x_data = df.iloc[1:-days, :].values
         y_data = y_data_df.iloc[1:-days].values
+        if horizons is not None:
+            y_data = y_data.T
 
-        df['y'] = y_data_df
-        df.iloc[1:-days].to_csv('training.csv')
+        targets = y_data_df.rename('y') if horizons is None else y_data_df
+        self.sink.write('training', lambda: df.join(targets).iloc[1:-days])
         return x_data, y_data
 
+    @staticmethod
+    def get_labels(price: pd.Series, horizons, thresholds=None) -> np.ndarray:
+        """Direction labels of every horizon in one pass, a (horizons x rows) matrix.
+
+        Without `thresholds` a label is 1 when the price `horizon` rows later is above today's, the
+        `Direction` column of `get_stock_data`. With sorted return `thresholds` it is the number of
+        thresholds the `horizon` row return exceeds, `thresholds=[0]` gives the same binary labels.
+        Rows without a future price are labelled like a rise.
+        """
+        price = np.asarray(price, dtype=np.float64)
+        horizons = np.asarray(horizons, dtype=np.int64)
+        ahead = np.arange(len(price)) + horizons[:, np.newaxis]
+        future = price.take(np.minimum(ahead, len(price) - 1))
+        future[ahead >= len(price)] = np.nan
+        if thresholds is None:
+            return np.where(future <= price, 0, 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            returns = future / price - 1
+        return np.searchsorted(np.sort(thresholds), returns, side='left')
+
+    # raw price columns left out of the features
+    EXCLUDED = ['Direction', 'Open', 'High', 'Low', 'Volume', 'Close']
+
+    @tracer.traced('MarketData.get_feature_data')
+    def get_feature_data(self, days=5, from_date='2014-04-01', to_date='2015-04-01', horizons=None,
+                         thresholds=None):
+        """Same x_data, y_data as `get_binary_data(get_stock_data())` without the intermediate frames.
+
+        The rows and columns are worked out first and every feature is written straight into one
+        column-major matrix, x_data and y_data are views into it. y_data is float, with `horizons`
+        it is the (horizons x rows) label matrix.
+        """
+        price = self.df[HeaderFactory.Price]
+        if horizons is None:
+            labels = self.get_labels(price, [days])
+        else:
+            labels = self.get_labels(price, horizons, thresholds)
+            days = max(horizons)
+        complete = self.df.notnull().values.all(axis=1)
+        columns = []
+        sources = []
+
+        def add(name, values):
+            columns.append(name)
+            sources.append(values)
+            complete[np.isnan(values)] = False
+
+        for column in self.df.columns:
+            if column not in self.EXCLUDED:
+                add(column, self.df[column].values)
+        add('Pct', price.pct_change().values)
+        for moving in self.ma:
+            add('{}ma'.format(moving), price.rolling(window=moving).mean().values)
+        if self.indicator is not None:
+            signal = self.indicator.calculate(self.df)
+            if not signal.index.equals(self.df.index):
+                signal = signal.reindex(self.df.index)
+            for column in signal.columns:
+                add(column, signal[column].values.astype(np.float64))
+
+        rows = np.flatnonzero(complete)
+        index = self.df.index[rows]
+        first = 0 if from_date is None else index.searchsorted(index_time(from_date, index))
+        last = len(index) if to_date is None else index.searchsorted(index_time(to_date, index), side='right')
+        rows = rows[first:last][1:-days]
+        index = self.df.index[rows]
+
+        additional = None
+        if self.df_additional is not None:
+            additional = self.df_additional.reindex(index)
+            columns.extend(additional.columns)
+
+        targets = ['y'] if horizons is None else ['y_{}'.format(horizon) for horizon in horizons]
+        matrix = np.empty((len(rows), len(columns) + len(targets)), order='F')
+        for position, values in enumerate(sources):
+            np.take(values, rows, out=matrix[:, position])
+        if additional is not None:
+            block = matrix[:, len(sources):len(columns)]
+            block[:] = additional.values
+            block[np.isnan(block)] = 0
+        matrix[:, len(columns):] = labels[:, rows].T
+
+        def result():
+            # the prices joined with the features computed above, before incomplete rows are dropped
+            features = pd.DataFrame(dict(zip(columns, sources)), index=self.df.index)
+            frame = self.df.join(features.drop(columns=self.df.columns, errors='ignore'))
+            if self.df_additional is not None:
+                frame = frame.join(self.df_additional)
+            return select_dates(frame, from_date, to_date)
+
+        self.sink.write('result', result)
+        self.sink.write('training', lambda: pd.DataFrame(matrix, index=index, columns=columns + targets))
+        if horizons is None:
+            return matrix[:, :-1], matrix[:, -1]
+        return matrix[:, :len(columns)], matrix[:, len(columns):].T
+
+    @tracer.traced('MarketData.get_stock_data')
     def get_stock_data(self):
         df = self.df.copy()
         # Percentage change
@@ -74,13 +187,39 @@ class MarketData(object):
 
 class QuandlMarketDataSource(object):
 
-    def get_stock_data(self, stock_name):
+    def __init__(self, mirror=None):
+        # optional MarketMirror.QuandlMirror serving the tables from local storage
+        self.mirror = mirror
+
+    def get_stock_data(self, stock_name, from_date=None, to_date=None):
         """
                 Return a dataframe of that stock and normalize all the values.
                 (Optional: create moving average)
                 """
-        logger.info("Loading Stock [%s]...", stock_name)
-        df = quandl.get_table('WIKI/PRICES', ticker=stock_name, paginate=True)
+        with tracer.span('quandl.get_stock_data', ticker=stock_name, mirror=self.mirror is not None) as span:
+            if self.mirror is not None:
+                df = self.mirror.get_stock_data(stock_name, from_date, to_date)
+                span.set(rows=len(df))
+                return df
+            logger.info("Loading Stock [%s]...", stock_name)
+            # only runs that actually download from Quandl pay for importing its client
+            import quandl
+            dates = {}
+            if from_date is not None:
+                dates['gte'] = pd.Timestamp(from_date).strftime('%Y-%m-%d')
+            if to_date is not None:
+                dates['lte'] = pd.Timestamp(to_date).strftime('%Y-%m-%d')
+            if dates:
+                df = quandl.get_table('WIKI/PRICES', ticker=stock_name, date=dates, paginate=True)
+            else:
+                df = quandl.get_table('WIKI/PRICES', ticker=stock_name, paginate=True)
+            df = self.normalize(df)
+            span.set(rows=len(df))
+            return df
+
+    @staticmethod
+    def normalize(df):
+        """Turn raw WIKI/PRICES rows into the adjusted Open/High/Low/Close/Volume frame."""
         df.drop(['ticker', 'open', 'high', 'low', 'close', 'ex-dividend', 'volume', 'split_ratio'], 1, inplace=True)
         df.set_index('date', inplace=True)
 
@@ -93,10 +232,69 @@ class QuandlMarketDataSource(object):
         return df
 
 
+def index_time(value, index):
+    """Timestamp of `value` comparable with `index`, which may be timezone aware."""
+    if value is None:
+        return None
+    value = pd.Timestamp(value)
+    if getattr(index, 'tz', None) is not None and value.tz is None:
+        value = value.tz_localize(index.tz)
+    return value
+
+
+def select_dates(df, from_date=None, to_date=None):
+    if from_date is None and to_date is None:
+        return df
+    return df.loc[index_time(from_date, df.index):index_time(to_date, df.index)]
+
+
+def align_frames(frames, from_date=None, to_date=None):
+    """Outer join of `frames` on their dates, missing values as 0, built in a single pass.
+
+    Returns the column-major float matrix with its date index and columns. Every frame is
+    written once into its own column block, nothing is merged pairwise.
+    """
+    index = frames[0].index
+    for frame in frames[1:]:
+        if not frame.index.equals(index):
+            index = index.union(frame.index)
+    if from_date is not None or to_date is not None:
+        first = 0 if from_date is None else index.searchsorted(index_time(from_date, index))
+        last = len(index) if to_date is None else index.searchsorted(index_time(to_date, index), side='right')
+        index = index[first:last]
+
+    columns = [column for frame in frames for column in frame.columns]
+    matrix = np.zeros((len(index), len(columns)), order='F')
+    position = 0
+    for frame in frames:
+        width = len(frame.columns)
+        rows = index.get_indexer(frame.index)
+        kept = rows >= 0
+        matrix[rows[kept], position:position + width] = frame.values[kept]
+        position += width
+    matrix[np.isnan(matrix)] = 0
+    return matrix, index, columns
+
+
 class RedditMarketDataSource(object):
 
-    def get_stock_data(self, stock_name):
+    def __init__(self, cache: FrameCache = None):
+        # parsed CSVs are kept as binary copies, pass cache=False to always parse
+        self.cache = FrameCache() if cache is None else cache
+
+    def get_stock_data(self, stock_name, from_date=None, to_date=None):
         file_path = path.join(Constants.DATASETS_MARKET, 'reddit/DJIA_table.csv')
+        with tracer.span('reddit.get_stock_data', ticker=stock_name) as span:
+            if self.cache:
+                market_data = self.cache.load(file_path, lambda: self.parse(file_path))
+            else:
+                market_data = self.parse(file_path)
+            market_data = select_dates(market_data, from_date, to_date)
+            span.set(rows=len(market_data))
+        return market_data
+
+    @staticmethod
+    def parse(file_path):
         logger.info("Loading [%s]...", file_path)
         market_data = pd.read_csv(file_path, na_values=['nan'])
         # drop unadjusted close
@@ -107,13 +305,29 @@ class RedditMarketDataSource(object):
         market_data.drop(labels=[HeaderFactory.Price], axis=1, inplace=True)
         market_data.rename(columns={"Adj Close": HeaderFactory.Price}, inplace=True)
         market_data.dropna(inplace=True)
-        return market_data
+        return market_data.astype(np.float64)
 
 
 class BloombergMarketDataSource(object):
 
-    def get_stock_data(self, stock_name: str):
+    def __init__(self, cache: FrameCache = None):
+        # parsed CSVs are kept as binary copies, pass cache=False to always parse
+        self.cache = FrameCache() if cache is None else cache
+
+    def get_stock_data(self, stock_name: str, from_date=None, to_date=None):
         file_path = path.join(Constants.DATASETS_MARKET, 'stock/{}.csv'.format(stock_name))
+        with tracer.span('bloomberg.get_stock_data', ticker=stock_name) as span:
+            if self.cache:
+                market_data = self.cache.load(file_path, lambda: self.parse(file_path, stock_name),
+                                              variant=stock_name.lower())
+            else:
+                market_data = self.parse(file_path, stock_name)
+            market_data = select_dates(market_data, from_date, to_date)
+            span.set(rows=len(market_data))
+        return market_data
+
+    @staticmethod
+    def parse(file_path, stock_name: str):
         logger.info("Loading [%s]...", file_path)
         market_data = pd.read_csv(file_path, na_values=['nan'])
         # drop unadjusted close
@@ -126,4 +340,4 @@ class BloombergMarketDataSource(object):
         market_data.rename(columns={'PX_OPEN': 'Open', 'PX_HIGH': 'High', 'PX_LOW': 'Low', 'PX_VOLUME': 'Volume',
                            'PX_LAST': HeaderFactory.Price}, inplace=True)
         # market_data.dropna(inplace=True)
-        return market_data
\ No newline at end of file
+        return market_data.astype(np.float64)
\ No newline at end of file
@@ -0,0 +1,153 @@
+import threading
+from collections import defaultdict, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from os import path
+
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+
+from MarketData import QuandlMarketDataSource, select_dates
+from utilities import Constants, logger
+from utilities.FrameCache import FrameCache
+
+
+class QuandlEndpoint(object):
+    """Quandl datatables REST endpoint returning raw WIKI/PRICES rows.
+
+    Every worker thread keeps its own pooled HTTP session, so the connections are reused
+    across pages and tickers. Point `url` at a local stand-in server for testing.
+    """
+
+    URL = 'https://www.quandl.com/api/v3/datatables/WIKI/PRICES.json'
+
+    def __init__(self, url: str = URL, api_key: str = None, pool_size: int = 8, timeout: float = 30):
+        self.url = url
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=3)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            self._local.session = session
+        return session
+
+    def fetch(self, ticker: str, from_date=None, to_date=None) -> pd.DataFrame:
+        params = {'ticker': ticker}
+        api_key = self.api_key
+        if api_key is None:
+            import quandl
+            api_key = quandl.ApiConfig.api_key
+        if api_key:
+            params['api_key'] = api_key
+        if from_date is not None:
+            params['date.gte'] = pd.Timestamp(from_date).strftime('%Y-%m-%d')
+        if to_date is not None:
+            params['date.lte'] = pd.Timestamp(to_date).strftime('%Y-%m-%d')
+
+        rows = []
+        columns = None
+        while True:
+            response = self._session().get(self.url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            content = response.json()
+            table = content['datatable']
+            columns = [column['name'] for column in table['columns']]
+            rows.extend(table['data'])
+            cursor = content.get('meta', {}).get('next_cursor_id')
+            if cursor is None:
+                break
+            params['qopts.cursor_id'] = cursor
+
+        df = pd.DataFrame(rows, columns=columns)
+        df['date'] = pd.to_datetime(df['date'])
+        return df
+
+
+class QuandlMirror(object):
+    """Local mirror of Quandl price tables.
+
+    Each ticker is stored with the date range it covers. Reads are served from disk and only
+    the dates outside the covered range are fetched from the endpoint and merged in.
+    """
+
+    def __init__(self, location: str = Constants.QUANDL_MIRROR, endpoint=None, workers: int = 8):
+        self.location = location
+        self.workers = workers
+        self.endpoint = QuandlEndpoint(pool_size=workers) if endpoint is None else endpoint
+        self._locks = defaultdict(threading.Lock)
+        self._locks_guard = threading.Lock()
+
+    def _lock(self, ticker: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks[ticker]
+
+    def get_stock_data(self, ticker: str, from_date=None, to_date=None) -> pd.DataFrame:
+        with self._lock(ticker):
+            frame = self.top_up(ticker, from_date, to_date)
+        return select_dates(frame, from_date, to_date)
+
+    def prefetch(self, tickers, from_date=None, to_date=None, workers: int = None) -> OrderedDict:
+        """Bring many tickers up to date concurrently, returns the stored rows per ticker.
+
+        Failed tickers are logged and reported as None.
+        """
+        tickers = list(OrderedDict.fromkeys(tickers))
+        result = OrderedDict((ticker, None) for ticker in tickers)
+        with ThreadPoolExecutor(max_workers=workers or self.workers) as executor:
+            futures = {executor.submit(self.get_stock_data, ticker, from_date, to_date): ticker
+                       for ticker in tickers}
+            for future in as_completed(futures):
+                ticker = futures[future]
+                try:
+                    result[ticker] = len(future.result())
+                except Exception:
+                    logger.exception("Failed to fetch [%s]", ticker)
+        return result
+
+    def top_up(self, ticker: str, from_date=None, to_date=None) -> pd.DataFrame:
+        base = path.join(self.location, ticker)
+        header = FrameCache.read_header(base)
+        stored = None if header is None else FrameCache.read(base, header)
+
+        start = None if from_date is None else pd.Timestamp(from_date).normalize()
+        today = pd.Timestamp.today().normalize()
+        end = today if to_date is None else min(pd.Timestamp(to_date).normalize(), today)
+        # today's bar may still change, it is stored but not covered, so the next read fetches it again
+        settled = min(end, today - pd.Timedelta(days=1))
+
+        if stored is None:
+            missing = [(start, end)]
+            covered_from, covered_to = start, settled
+        else:
+            covered_from = None if header['covered_from'] is None else pd.Timestamp(header['covered_from'])
+            covered_to = pd.Timestamp(header['covered_to'])
+            missing = []
+            if covered_from is not None and (start is None or start < covered_from):
+                missing.append((start, covered_from - pd.Timedelta(days=1)))
+                covered_from = start
+            if end > covered_to:
+                missing.append((covered_to + pd.Timedelta(days=1), end))
+                covered_to = max(covered_to, settled)
+        if not missing:
+            return stored
+
+        parts = [] if stored is None else [stored]
+        for first, last in missing:
+            logger.info("Fetching [%s] from %s to %s", ticker, first, last)
+            parts.append(QuandlMarketDataSource.normalize(self.endpoint.fetch(ticker, first, last)))
+        frame = pd.concat(parts)
+        frame = frame[~frame.index.duplicated(keep='last')].sort_index()
+
+        FrameCache.write(base, frame, {
+            'ticker': ticker,
+            'covered_from': None if covered_from is None else covered_from.strftime('%Y-%m-%d'),
+            'covered_to': covered_to.strftime('%Y-%m-%d')
+        })
+        return frame
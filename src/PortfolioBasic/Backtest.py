@@ -0,0 +1,174 @@
+import itertools
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from PortfolioBasic.Definitions import HeaderFactory
+
+logger = logging.getLogger(__name__)
+
+
+class BacktestResult(object):
+    """Positions and returns of one parameter combination."""
+
+    def __init__(self, positions: pd.DataFrame, returns: pd.DataFrame, portfolio: pd.Series):
+        self.positions = positions
+        self.returns = returns
+        self.portfolio = portfolio
+
+    @property
+    def equity(self) -> pd.Series:
+        return (1 + self.portfolio).cumprod()
+
+    def orders(self) -> pd.DataFrame:
+        """Position changes as BUY/SELL/EXIT orders with the traded shares, one row per ticker and date."""
+        change = self.positions.diff()
+        change.iloc[0] = self.positions.iloc[0]
+        change = change.stack()
+        change = change[change != 0]
+        target = self.positions.stack().reindex(change.index)
+        order = np.where(target == 0, HeaderFactory.EXIT, np.where(change > 0, HeaderFactory.BUY, HeaderFactory.SELL))
+        return pd.DataFrame({HeaderFactory.Order: order, HeaderFactory.Shares: change.values},
+                            index=change.index, columns=[HeaderFactory.Order, HeaderFactory.Shares])
+
+    def statistics(self) -> pd.Series:
+        values = Backtest.statistics(self.portfolio.values[np.newaxis], self.positions.values[np.newaxis])
+        return pd.Series(OrderedDict((name, value[0]) for name, value in values.items()))
+
+
+class Backtest(object):
+    """Vectorized backtest of classifier outputs over one or many tickers.
+
+    A ticker is held long while its signal (prediction or up probability) is at or above `buy`,
+    short while it is at or below `sell` (flat instead with `allow_short=False`) and flat in
+    between. Positions are decided on the close and earn the next day's return. A position is
+    closed on the close the trade's return reaches -StopLow or +StopHigh and stays flat until
+    the signal changes side. Costs are charged per unit of position traded. Capital is split
+    equally between the tickers.
+
+    Every parameter combination of a `sweep` is simulated at once along a leading axis, there
+    is no loop over days.
+    """
+
+    TRADING_DAYS = 252
+
+    def __init__(self, prices, signals, allow_short: bool = True):
+        prices = prices.to_frame() if isinstance(prices, pd.Series) else prices
+        signals = signals.to_frame(prices.columns[0]) if isinstance(signals, pd.Series) else signals
+        signals = signals.reindex(index=prices.index, columns=prices.columns)
+        self.index = prices.index
+        self.tickers = prices.columns
+        self.prices = prices.values.astype(np.float64)
+        self.signals = signals.values.astype(np.float64)
+        self.allow_short = allow_short
+        with np.errstate(invalid='ignore', divide='ignore'):
+            change = self.prices[1:] / self.prices[:-1] - 1
+        self.asset_returns = np.vstack([np.zeros((1, self.prices.shape[1])), np.nan_to_num(change)])
+
+    def run(self, buy: float = 0.5, sell: float = 0.5, stop_low: float = np.nan, stop_high: float = np.nan,
+            cost: float = 0.0) -> BacktestResult:
+        positions = self.simulate(*[np.array([value], dtype=np.float64) for value in (buy, sell, stop_low, stop_high)])
+        positions = positions[0]
+        returns = self.ticker_returns(positions) - cost * self.turnover(positions)
+        return BacktestResult(pd.DataFrame(positions, index=self.index, columns=self.tickers),
+                              pd.DataFrame(returns, index=self.index, columns=self.tickers),
+                              pd.Series(returns.mean(axis=1), index=self.index))
+
+    def sweep(self, buy=(0.5,), sell=(0.5,), stop_low=(np.nan,), stop_high=(np.nan,), cost=(0.0,),
+              chunk_size: int = None) -> pd.DataFrame:
+        """Statistics of every combination of the parameter lists, one row per combination."""
+        grid = np.array(list(itertools.product(buy, sell, stop_low, stop_high)), dtype=np.float64)
+        cost = np.asarray(cost, dtype=np.float64)
+        if chunk_size is None:
+            # keep the (combinations x days x tickers) intermediates around 8MB each
+            chunk_size = max(1, int(1024 * 1024 // max(1, self.prices.size)))
+        parts = []
+        for start in range(0, len(grid), chunk_size):
+            positions = self.simulate(*grid[start:start + chunk_size].T)
+            # positions do not depend on the cost, only the portfolio returns are built per cost
+            gross = self.ticker_returns(positions).mean(axis=2)
+            turnover = self.turnover(positions).mean(axis=2)
+            portfolio = gross[:, np.newaxis] - cost[np.newaxis, :, np.newaxis] * turnover[:, np.newaxis]
+            parts.append(self.statistics(portfolio.reshape(-1, portfolio.shape[2]), positions, len(cost)))
+        statistics = OrderedDict((name, np.concatenate([part[name] for part in parts])) for name in parts[0])
+
+        result = pd.DataFrame(np.hstack([np.repeat(grid, len(cost), axis=0), np.tile(cost, len(grid))[:, np.newaxis]]),
+                              columns=['buy', 'sell', HeaderFactory.StopLow, HeaderFactory.StopHigh, 'cost'])
+        for name, values in statistics.items():
+            result[name] = values
+        return result
+
+    def simulate(self, buy, sell, stop_low, stop_high) -> np.ndarray:
+        """Positions for K parameter combinations, (K x days x tickers)."""
+        buy, sell, stop_low, stop_high = [np.asarray(value, dtype=np.float64)
+                                          for value in (buy, sell, stop_low, stop_high)]
+        # the trades only depend on the thresholds, shared by all stops of the same thresholds
+        thresholds, inverse = np.unique(np.stack([buy, sell], axis=1), axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        signals = self.signals[np.newaxis]
+        prices = self.prices[np.newaxis]
+        with np.errstate(invalid='ignore'):
+            desired = np.where(signals >= thresholds[:, 0, np.newaxis, np.newaxis], 1.0,
+                               np.where(signals <= thresholds[:, 1, np.newaxis, np.newaxis],
+                                        -1.0 if self.allow_short else 0.0, 0.0))
+        desired = np.where(np.isnan(signals) | np.isnan(prices), 0.0, desired)
+
+        # each run of the same desired position is one trade, entered at the run's first close
+        days = np.arange(desired.shape[1])[np.newaxis, :, np.newaxis]
+        first = np.ones(desired.shape, dtype=bool)
+        first[:, 1:] = desired[:, 1:] != desired[:, :-1]
+        start = np.maximum.accumulate(np.where(first, days, 0), axis=1)
+        entry = np.take_along_axis(np.broadcast_to(prices, desired.shape), start, axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            gain = desired * (prices / entry - 1)
+
+        desired, gain, start = desired[inverse], gain[inverse], start[inverse]
+        with np.errstate(invalid='ignore'):
+            hit = (gain <= -stop_low[:, np.newaxis, np.newaxis]) | (gain >= stop_high[:, np.newaxis, np.newaxis])
+        hit &= desired != 0
+        hits = np.cumsum(hit, axis=1)
+        before = np.take_along_axis(hits - hit, start, axis=1)
+        return np.where(hits > before, 0.0, desired)
+
+    def ticker_returns(self, positions: np.ndarray) -> np.ndarray:
+        """Returns earned by the positions before costs, held from one close to the next."""
+        returns = np.zeros(positions.shape)
+        returns[..., 1:, :] = positions[..., :-1, :] * self.asset_returns[1:]
+        return returns
+
+    @staticmethod
+    def turnover(positions: np.ndarray) -> np.ndarray:
+        """Units of position traded on every close."""
+        previous = np.zeros(positions.shape)
+        previous[..., 1:, :] = positions[..., :-1, :]
+        return np.abs(positions - previous)
+
+    @staticmethod
+    def statistics(portfolio: np.ndarray, positions: np.ndarray, repeat: int = 1) -> OrderedDict:
+        """Summary of (K x days) portfolio returns and their (K / repeat x days x tickers) positions.
+
+        Consecutive `repeat` portfolios share the same positions, as with several costs.
+        """
+        days = portfolio.shape[1]
+        equity = np.cumprod(1 + portfolio, axis=1)
+        total = equity[:, -1] - 1
+        mean = portfolio.mean(axis=1)
+        volatility = portfolio.std(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            sharpe = np.where(volatility > 0, mean / volatility * np.sqrt(Backtest.TRADING_DAYS), np.nan)
+            annual = np.where(total > -1, np.abs(1 + total) ** (Backtest.TRADING_DAYS / float(days)) - 1, -1.0)
+        drawdown = (equity / np.maximum.accumulate(equity, axis=1) - 1).min(axis=1)
+        entries = np.ones(positions.shape, dtype=bool)
+        entries[:, 1:] = positions[:, 1:] != positions[:, :-1]
+        trades = np.repeat((entries & (positions != 0)).sum(axis=(1, 2)), repeat)
+        return OrderedDict([
+            ('total_return', total),
+            ('annual_return', annual),
+            ('volatility', volatility * np.sqrt(Backtest.TRADING_DAYS)),
+            ('sharpe', sharpe),
+            ('max_drawdown', drawdown),
+            ('trades', trades),
+            ('exposure', np.repeat(np.abs(positions).mean(axis=(1, 2)), repeat))
+        ])
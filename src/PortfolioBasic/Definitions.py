@@ -20,6 +20,8 @@ class HeaderFactory(object):
     MACHINE = 'MACHINE'
     RSI = 'RSI'
     MOM = 'MOM'
+    BETA = 'BETA'
+    CORR = 'CORR'
     MACD_HIST= 'MACD_HIST'
     MACD_SIGNAL = 'MACD_SIGNAL'
     MACD_DIFF = 'MACD_DIFF'
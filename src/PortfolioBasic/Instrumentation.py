@@ -0,0 +1,280 @@
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+
+class NullSpan(object):
+    """Returned while tracing is disabled, does nothing."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def set(self, **args):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span(object):
+    """One timed stage, nested under the span open on the same thread when it started."""
+
+    def __init__(self, tracer, name: str, args: dict):
+        self.tracer = tracer
+        self.name = name
+        self.args = args
+        self.path = name
+        self.depth = 0
+        self.thread = None
+        self.start = None
+        self.end = None
+        # bytes, only tracked with Tracer.enable(memory=True)
+        self.peak = None
+        self.retained = None
+        self.rss = None
+        self._baseline = None
+        self._child_peak = 0
+
+    def set(self, **args):
+        """Attach values such as row counts to the span."""
+        self.args.update(args)
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+    def __enter__(self):
+        stack = self.tracer.stack()
+        if stack:
+            self.path = stack[-1].path + '/' + self.name
+            self.depth = len(stack)
+        stack.append(self)
+        self.thread = threading.get_ident()
+        if self.tracer.memory:
+            current, peak = tracemalloc.get_traced_memory()
+            if len(stack) > 1:
+                # the peak is reset below, the parent keeps what it saw so far
+                parent = stack[-2]
+                parent._child_peak = max(parent._child_peak, peak)
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+            self._baseline = current
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.end = time.perf_counter()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        stack = self.tracer.stack()
+        stack.pop()
+        if self.tracer.memory and self._baseline is not None:
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, self._child_peak)
+            if stack:
+                stack[-1]._child_peak = max(stack[-1]._child_peak, peak)
+            self.peak = peak - self._baseline
+            self.retained = current - self._baseline
+            if psutil is not None:
+                self.rss = psutil.Process().memory_info().rss
+        self.tracer.record(self)
+        if exc_type is None:
+            self.tracer.check_budget(self)
+        return False
+
+
+class Tracer(object):
+    """Collects nested stage spans of the pipeline.
+
+    Disabled by default, `span` then returns a shared no-op context so instrumented code pays
+    one attribute check. With memory tracking every span also gets its peak and retained
+    allocations, which `set_budget` can hold to per-stage ceilings. Finished spans can be
+    summarized per stage or exported as JSON and in the Chrome trace-event format
+    (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.memory = False
+        # {stage name or path: bytes} ceilings of the span peak, see `set_budget`
+        self.budgets = {}
+        self.budget_action = 'warn'
+        self.spans = []
+        self._started_tracemalloc = False
+        self.origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self, memory: bool = False):
+        """Start collecting spans, with `memory` also their peak and retained Python allocations.
+
+        Memory is measured with tracemalloc, which slows allocations down noticeably and is
+        process wide, so stages running concurrently on other threads are counted too. Before
+        Python 3.9 peaks can not be reset and are the highest usage since tracing started.
+        """
+        self.enabled = True
+        if memory and not self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started_tracemalloc = True
+            self.memory = True
+
+    def disable(self):
+        self.enabled = False
+        if self.memory:
+            self.memory = False
+            if self._started_tracemalloc:
+                tracemalloc.stop()
+                self._started_tracemalloc = False
+
+    def set_budget(self, budgets: dict, action: str = 'warn'):
+        """Memory ceilings in bytes per stage name or path, `action` is 'warn' or 'raise'.
+
+        A stage whose peak goes over its ceiling is logged, or fails with MemoryBudgetExceeded.
+        """
+        if action not in ('warn', 'raise'):
+            raise ValueError("Unknown budget action {}".format(action))
+        self.budgets = dict(budgets)
+        self.budget_action = action
+
+    def check_budget(self, span: Span):
+        if not self.budgets or span.peak is None:
+            return
+        ceiling = self.budgets.get(span.path, self.budgets.get(span.name))
+        if ceiling is None or span.peak <= ceiling:
+            return
+        message = "Stage {} peaked at {:.1f}MB, budget is {:.1f}MB".format(
+            span.path, span.peak / 2.0 ** 20, ceiling / 2.0 ** 20)
+        if self.budget_action == 'raise':
+            raise MemoryBudgetExceeded(message)
+        logger.warning(message)
+
+    def clear(self):
+        with self._lock:
+            self.spans = []
+            self.origin = time.perf_counter()
+
+    def span(self, name: str, **args):
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, args)
+
+    def traced(self, name: str = None):
+        """Decorator running the function inside a span, named after the function by default."""
+        def decorator(function):
+            span_name = name or function.__qualname__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                with self.span(span_name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def stack(self) -> list:
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def record(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> OrderedDict:
+        """Count, total and maximum seconds and summed rows per stage path, in order of first start."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda item: item.start)
+        stages = OrderedDict()
+        for span in spans:
+            stage = stages.get(span.path)
+            if stage is None:
+                stage = stages[span.path] = OrderedDict([('count', 0), ('total', 0.0), ('max', 0.0)])
+            stage['count'] += 1
+            stage['total'] += span.duration
+            stage['max'] = max(stage['max'], span.duration)
+            if 'rows' in span.args:
+                stage['rows'] = stage.get('rows', 0) + span.args['rows']
+            if span.peak is not None:
+                stage['peak'] = max(stage.get('peak', 0), span.peak)
+                stage['retained'] = stage.get('retained', 0) + span.retained
+        return stages
+
+    def report(self) -> str:
+        lines = ['{:<60} {:>7} {:>10} {:>10} {:>10} {:>10} {:>10}'.format(
+            'stage', 'count', 'total s', 'max s', 'rows', 'peak MB', 'kept MB')]
+        for path, stage in self.summary().items():
+            memory = ['{:.2f}'.format(stage[name] / 2.0 ** 20) if name in stage else ''
+                      for name in ('peak', 'retained')]
+            lines.append('{:<60} {:>7} {:>10.4f} {:>10.4f} {:>10} {:>10} {:>10}'.format(
+                '  ' * path.count('/') + path.rsplit('/', 1)[-1], stage['count'], stage['total'], stage['max'],
+                stage.get('rows', ''), *memory))
+        return '\n'.join(lines)
+
+    def to_json(self) -> dict:
+        with self._lock:
+            spans = sorted(self.spans, key=lambda item: item.start)
+        return {
+            'stages': self.summary(),
+            'spans': [OrderedDict([('name', span.name), ('path', span.path), ('thread', span.thread),
+                                   ('start', span.start - self.origin), ('duration', span.duration),
+                                   ('peak', span.peak), ('retained', span.retained), ('rss', span.rss),
+                                   ('args', span.args)])
+                      for span in spans]
+        }
+
+    def to_chrome(self) -> dict:
+        """Complete ('X') trace events, timestamps in microseconds."""
+        with self._lock:
+            spans = sorted(self.spans, key=lambda item: item.start)
+        pid = os.getpid()
+        events = []
+        for span in spans:
+            args = span.args
+            if span.peak is not None:
+                args = dict(args, peak=span.peak, retained=span.retained)
+            events.append({'name': span.name, 'cat': span.path.split('/', 1)[0], 'ph': 'X', 'pid': pid,
+                           'tid': span.thread, 'ts': (span.start - self.origin) * 1e6, 'dur': span.duration * 1e6,
+                           'args': args})
+            if span.rss is not None:
+                # counter track of the process memory next to the stages
+                events.append({'name': 'rss', 'ph': 'C', 'pid': pid, 'ts': (span.end - self.origin) * 1e6,
+                               'args': {'rss': span.rss}})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def export_json(self, file_name: str):
+        self._export(file_name, self.to_json())
+
+    def export_chrome(self, file_name: str):
+        self._export(file_name, self.to_chrome())
+
+    @staticmethod
+    def _export(file_name: str, content: dict):
+        with open(file_name, 'w') as stream:
+            json.dump(content, stream, indent=1, default=str)
+        logger.info("Trace written to [%s]", file_name)
+
+
+# shared by the whole pipeline, call tracer.enable() to start collecting
+tracer = Tracer()
@@ -1,21 +1,30 @@
-import pandas as pd
 import logging
+import time
+from collections import OrderedDict
 
+import numpy as np
+import pandas as pd
 from stockstats import StockDataFrame
 
 from PortfolioBasic.Definitions import HeaderFactory
+from PortfolioBasic.Technical.Filters import RecursiveFilter
+from PortfolioBasic.Technical.Rolling import RollingWindow
 
 logger = logging.getLogger(__name__)
 
 
 class TechnicalPerformance:
     @staticmethod
-    def compute_std(data: pd.DataFrame, window=20):
-        # 1. Compute rolling mean
-        rm = data.rolling(center=False, window=window).mean()
-        # 2. Compute rolling standard deviation
-        rstd = data.rolling(window=window, center=False).std()
-        return rm, rstd
+    def compute_std(data, window=20):
+        """Rolling mean and standard deviation of a Series or DataFrame, from one pass over the moments."""
+        bands = RollingWindow.bollinger(data.values, window)
+        return TechnicalPerformance._like(data, bands['mean']), TechnicalPerformance._like(data, bands['std'])
+
+    @staticmethod
+    def _like(data, values):
+        if isinstance(data, pd.Series):
+            return pd.Series(values, index=data.index, name=data.name)
+        return pd.DataFrame(values, index=data.index, columns=data.columns)
 
     @staticmethod
     def compute_adr(data: pd.DataFrame, period=7):
@@ -42,50 +51,60 @@ class TechnicalPerformance:
 
     @staticmethod
     def compute_macd(data: pd.DataFrame, n_fast=12, n_slow=26, signal_period=9) -> pd.DataFrame:
-        '''
-            Function to return the difference between the most recent
-            MACD value and MACD signal. Positive values are long
-            position entry signals
-
-            optional args:
-                n_fast = 12
-                n_slow =
-                 26
-                signal_period = 9
-            Returns: panda macd
-            '''
-
-        macd = data.apply(TechnicalPerformance._MACD, fastperiod=n_fast, slowperiod=n_slow, signalperiod=signal_period)
-        macd = macd.unstack().reset_index()
-        if len(macd['level_0']) > 0:
-            macd['level_0'] = macd['level_0'] + '_' + macd['level_1']
-        else:
-            macd['level_0'] = macd['level_1']
-        macd = macd.drop('level_1', axis=1)
-        raw_data = macd[0].apply(lambda x: pd.Series(x))
-        macd = macd.drop(0, axis=1).join(raw_data).transpose().reset_index()
-        macd.columns = macd.iloc[0]
-        macd = macd.drop('level_0', axis=1)
-        result = pd.DataFrame(index=data.index, data=macd.iloc[1:].values, columns=macd.columns)
+        """MACD line, signal and histogram of every price column, as the stockstats `macd`, `macds`, `macdh`.
+
+        The EMAs of all columns are filtered in one pass over the (dates x columns) matrix.
+        Returns `<column>_MACD`, `<column>_MACD_SIGNAL` and `<column>_MACD_HIST` per column.
+        """
+        prices = data.values.astype(np.float64)
+        macd = RecursiveFilter.ema(prices, n_fast) - RecursiveFilter.ema(prices, n_slow)
+        signal = RecursiveFilter.ema(macd, signal_period)
+        hist = 2 * (macd - signal)
+        fields = (HeaderFactory.MACD, HeaderFactory.MACD_SIGNAL, HeaderFactory.MACD_HIST)
+        columns = [HeaderFactory.get_name(str(column), field) for column in data.columns for field in fields]
+        # (dates x columns x fields), so the fields of one column stay next to each other
+        values = np.stack([macd, signal, hist], axis=2).reshape(len(data), -1)
+        return pd.DataFrame(values, index=data.index, columns=columns)
+
+    @staticmethod
+    def compute_macd_per_column(data: pd.DataFrame) -> pd.DataFrame:
+        """Reference building a StockDataFrame per column, matches `compute_macd` with the default periods."""
+        fields = (HeaderFactory.MACD, HeaderFactory.MACD_SIGNAL, HeaderFactory.MACD_HIST)
+        results = []
+        for column in data.columns:
+            macd = TechnicalPerformance._MACD(data[column])
+            results.append(pd.DataFrame(OrderedDict((HeaderFactory.get_name(str(column), field), macd[field].values)
+                                                    for field in fields), index=data.index))
+        return pd.concat(results, axis=1)
+
+    @staticmethod
+    def macd_throughput(data: pd.DataFrame, repeat=3) -> OrderedDict:
+        """Price columns per second of `compute_macd` against `compute_macd_per_column`, best of `repeat`."""
+        result = OrderedDict()
+        for name, function in (('vectorized', TechnicalPerformance.compute_macd),
+                               ('per_column', TechnicalPerformance.compute_macd_per_column)):
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                function(data)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            result[name] = len(data.columns) / best
+            logger.info("MACD %s: %.0f columns/s over %d rows", name, result[name], len(data))
+        result['speedup'] = result['vectorized'] / result['per_column']
         return result
 
     # Define the MACD function
     @staticmethod
-    def _MACD(prices, fastperiod=12, slowperiod=26, signalperiod=9):
+    def _MACD(prices: pd.Series):
         '''
-        Function to return the difference between the most recent
-        MACD value and MACD signal. Positive values are long
-        position entry signals
-
-        optional args:
-            fastperiod = 12
-            slowperiod = 26
-            signalperiod = 9
+        MACD line, signal and histogram of one price series from stockstats, which always
+        uses the 12/26/9 periods. Positive histogram values are long position entry signals.
 
-        Returns: macd - signal
+        Returns: pd.Series of the three columns
         '''
 
-        stock = StockDataFrame.retype(prices)
+        stock = StockDataFrame.retype(prices.to_frame('close'))
         macd = stock['macd']
         signal = stock['macds']
         hist = stock['macdh']
@@ -94,21 +113,14 @@ class TechnicalPerformance:
 
     @staticmethod
     def compute_bollinger_bands(data: pd.DataFrame, window=20, deviation=2):
-        # Compute Bollinger Bands
-        # 1. Compute rolling mean
-
-        rm, rstd = TechnicalPerformance.compute_std(data, window)
-        # 3. Compute upper and lower bands
-        upper_band, lower_band = TechnicalPerformance.get_bollinger_bands(rm, rstd, deviation)
-        rm.columns = HeaderFactory.get_name(rm.columns, HeaderFactory.SMA)
-        rstd.columns = HeaderFactory.get_name(rstd.columns, HeaderFactory.RSTD)
-        upper_band.columns = HeaderFactory.get_name(upper_band.columns, HeaderFactory.BB_UPPER_BAND)
-        lower_band.columns = HeaderFactory.get_name(lower_band.columns, HeaderFactory.BB_LOWER_BAND)
-        data = data.join(rm)
-        data = data.join(rstd)
-        data = data.join(lower_band)
-        data = data.join(upper_band)
-        return data
+        # rolling mean, deviation and both bands of all columns come out of one kernel call
+        bands = RollingWindow.bollinger(data.values, window, deviation)
+        results = [data]
+        for name, header in (('mean', HeaderFactory.SMA), ('std', HeaderFactory.RSTD),
+                             ('lower', HeaderFactory.BB_LOWER_BAND), ('upper', HeaderFactory.BB_UPPER_BAND)):
+            results.append(pd.DataFrame(bands[name], index=data.index,
+                                        columns=HeaderFactory.get_name(data.columns, header)))
+        return pd.concat(results, axis=1)
 
     @staticmethod
     def get_rolling_mean(values, window):
@@ -0,0 +1,164 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from os import path
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+class IndicatorCache(object):
+    """Content addressed on-disk store of indicator results.
+
+    Entries are keyed on a fingerprint of the input frame plus the indicator class and
+    parameters, and saved column by column in uncompressed `.npz` files. Date indexes are stored as
+    UTC nanoseconds with their timezone name, like `FrameCache`. Reading an entry
+    refreshes its modification time, the least recently used entries are evicted once the
+    directory grows over `max_bytes`.
+    """
+
+    EXTENSION = '.npz'
+    # part of every key, bump it when the output of an indicator changes
+    CACHE_VERSION = 1
+
+    def __init__(self, location: str, max_bytes: int = 512 * 1024 * 1024):
+        self.location = location
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not path.exists(location):
+            os.makedirs(location)
+
+    @staticmethod
+    def fingerprint(data: pd.DataFrame) -> str:
+        digest = hashlib.sha1()
+        digest.update(pd.util.hash_pandas_object(data, index=True).values.tobytes())
+        digest.update(json.dumps([str(column) for column in data.columns]).encode('utf-8'))
+        digest.update(json.dumps([str(dtype) for dtype in data.dtypes]).encode('utf-8'))
+        return digest.hexdigest()
+
+    @staticmethod
+    def describe(indicator) -> str:
+        """Return a stable description of the indicator class and its parameters."""
+        parameters = {}
+        for name, value in sorted(vars(indicator).items()):
+            if name == 'state' or name.startswith('_'):
+                continue
+            if isinstance(value, (list, tuple)):
+                value = [IndicatorCache.describe(item) if hasattr(item, 'calculate') else item for item in value]
+            elif hasattr(value, 'calculate'):
+                value = IndicatorCache.describe(value)
+            elif isinstance(value, pd.Series):
+                value = IndicatorCache.fingerprint(value.to_frame())
+            elif isinstance(value, pd.DataFrame):
+                value = IndicatorCache.fingerprint(value)
+            parameters[name] = value
+        return '{}.{}{}'.format(type(indicator).__module__, type(indicator).__name__,
+                                json.dumps(parameters, sort_keys=True, default=str))
+
+    def key(self, indicator, data: pd.DataFrame) -> str:
+        digest = hashlib.sha1()
+        digest.update(str(self.CACHE_VERSION).encode('utf-8'))
+        digest.update(self.describe(indicator).encode('utf-8'))
+        digest.update(self.fingerprint(data).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _file(self, key: str) -> str:
+        return path.join(self.location, key + self.EXTENSION)
+
+    def get(self, key: str):
+        file_name = self._file(key)
+        if not path.exists(file_name):
+            self.misses += 1
+            return None
+        try:
+            with np.load(file_name, allow_pickle=False) as stored:
+                columns = list(stored['columns'])
+                if stored['datetime_index']:
+                    index = pd.DatetimeIndex(stored['index'].view('datetime64[ns]'), name=str(stored['index_name']) or None)
+                    tz = str(stored['tz'])
+                    if tz:
+                        index = index.tz_localize('UTC').tz_convert(tz)
+                else:
+                    index = pd.Index(stored['index'], name=str(stored['index_name']) or None)
+                values = {column: stored['column_{}'.format(i)] for i, column in enumerate(columns)}
+        except (IOError, ValueError, KeyError):
+            logger.warning("Dropping unreadable cache entry [%s]", file_name)
+            self._remove(file_name)
+            self.misses += 1
+            return None
+
+        try:
+            os.utime(file_name, None)
+        except OSError:
+            # evicted by another loader since it was read, the values are still valid
+            pass
+        self.hits += 1
+        return pd.DataFrame(values, index=index, columns=columns)
+
+    def put(self, key: str, result: pd.DataFrame):
+        datetime_index = isinstance(result.index, pd.DatetimeIndex)
+        tz = ''
+        if datetime_index:
+            index = result.index
+            if index.tz is not None:
+                tz = str(index.tz)
+                index = index.tz_convert('UTC').tz_localize(None)
+            index = index.values.view('int64')
+        else:
+            index = np.asarray(result.index)
+            if index.dtype == object:
+                logger.warning("Index of %s can not be cached", key)
+                return
+        arrays = {'column_{}'.format(i): np.ascontiguousarray(result[column].values)
+                  for i, column in enumerate(result.columns)}
+        handle, temp_name = tempfile.mkstemp(suffix='.tmp', dir=self.location)
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                np.savez(stream,
+                         columns=np.array([str(column) for column in result.columns]),
+                         index=index,
+                         index_name=np.array(result.index.name or ''),
+                         datetime_index=np.array(datetime_index),
+                         tz=np.array(tz),
+                         **arrays)
+            os.replace(temp_name, self._file(key))
+        except Exception:
+            self._remove(temp_name)
+            raise
+        self.evict()
+
+    def evict(self):
+        entries = []
+        for name in os.listdir(self.location):
+            if name.endswith(self.EXTENSION):
+                file_name = path.join(self.location, name)
+                try:
+                    info = os.stat(file_name)
+                except OSError:
+                    continue
+                entries.append((info.st_mtime_ns, info.st_size, file_name))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, file_name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            logger.debug("Evicting [%s]", file_name)
+            self._remove(file_name)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.location):
+            if name.endswith(self.EXTENSION):
+                self._remove(path.join(self.location, name))
+
+    @staticmethod
+    def _remove(file_name):
+        try:
+            os.remove(file_name)
+        except OSError:
+            pass
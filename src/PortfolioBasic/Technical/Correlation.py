@@ -0,0 +1,114 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from PortfolioBasic.Technical.Rolling import RollingWindow
+
+logger = logging.getLogger(__name__)
+
+
+class RollingCorrelation(object):
+    """Rolling covariance, beta and correlation of many tickers against benchmarks.
+
+    Every statistic comes from rolling sums of the first and second moments, each a difference
+    of one cumulative sum, so a window costs O(tickers x dates) whatever its length. Pairs are
+    compared on the dates both have a return, ddof=1 as `rolling(window).cov()`.
+    """
+
+    def __init__(self, returns: pd.DataFrame, benchmarks: pd.DataFrame = None):
+        self.index = returns.index
+        self.tickers = returns.columns
+        self.returns = returns.values.astype(np.float64)
+        if benchmarks is None:
+            benchmarks = pd.DataFrame(index=returns.index)
+        benchmarks = benchmarks.reindex(self.align(benchmarks.index, returns.index))
+        benchmarks.index = returns.index
+        self.benchmarks = OrderedDict((name, benchmarks[name].values.astype(np.float64))
+                                      for name in benchmarks.columns)
+
+    @staticmethod
+    def align(index: pd.Index, target: pd.Index) -> pd.Index:
+        """`target` dates in the timezone of `index`, Bloomberg files mix naive and UTC dates."""
+        source_tz, target_tz = getattr(index, 'tz', None), getattr(target, 'tz', None)
+        if source_tz is None and target_tz is not None:
+            return target.tz_localize(None)
+        if source_tz is not None and target_tz is None:
+            return target.tz_localize(source_tz)
+        return target
+
+    @staticmethod
+    def from_prices(prices: pd.DataFrame, benchmarks: pd.DataFrame = None):
+        """Engine on the daily returns of price frames, as `TechnicalPerformance.estimateBeta`."""
+        changes = lambda frame: None if frame is None else frame / frame.shift(1) - 1
+        return RollingCorrelation(changes(prices), changes(benchmarks))
+
+    def moments(self, benchmark: str, window: int, min_periods: int = None):
+        """Rolling (covariance, ticker variance, benchmark variance) against `benchmark`, each (dates x tickers)."""
+        return RollingCorrelation.rolling_moments(self.returns, self.benchmarks[benchmark][:, np.newaxis], window,
+                                                  min_periods)
+
+    @staticmethod
+    def rolling_moments(x: np.ndarray, y: np.ndarray, window: int, min_periods: int = None):
+        """`moments` of the (dates x tickers) returns `x` against the benchmark returns `y`, one column or one per ticker."""
+        y = np.broadcast_to(y, x.shape)
+        valid = ~np.isnan(x) & ~np.isnan(y)
+        # centred on the column means, which keeps the cancellation error small
+        x = np.where(valid, x - np.nanmean(np.where(valid, x, np.nan), axis=0), 0.0)
+        y = np.where(valid, y - np.nanmean(np.where(valid, y, np.nan), axis=0), 0.0)
+        counts = RollingWindow.sums(valid, window)
+        sum_x, sum_y = RollingWindow.sums(x, window), RollingWindow.sums(y, window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            scale = 1.0 / (counts - 1)
+            covariance = (RollingWindow.sums(x * y, window) - sum_x * sum_y / counts) * scale
+            variance_x = np.maximum((RollingWindow.sums(x * x, window) - sum_x * sum_x / counts) * scale, 0.0)
+            variance_y = np.maximum((RollingWindow.sums(y * y, window) - sum_y * sum_y / counts) * scale, 0.0)
+        missing = counts < max(window if min_periods is None else min_periods, 2)
+        for values in (covariance, variance_x, variance_y):
+            values[missing] = np.nan
+        return covariance, variance_x, variance_y
+
+    def covariance(self, window: int, min_periods: int = None) -> OrderedDict:
+        return self._per_benchmark(window, min_periods, lambda covariance, variance_x, variance_y: covariance)
+
+    def beta(self, window: int, min_periods: int = None) -> OrderedDict:
+        """{benchmark: (dates x tickers) rolling beta}."""
+        return self._per_benchmark(window, min_periods,
+                                   lambda covariance, variance_x, variance_y: covariance / variance_y)
+
+    def correlation(self, window: int, min_periods: int = None) -> OrderedDict:
+        return self._per_benchmark(window, min_periods, lambda covariance, variance_x, variance_y:
+                                   covariance / np.sqrt(variance_x * variance_y))
+
+    def _per_benchmark(self, window, min_periods, statistic) -> OrderedDict:
+        result = OrderedDict()
+        for benchmark in self.benchmarks:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                values = statistic(*self.moments(benchmark, window, min_periods))
+            result[benchmark] = pd.DataFrame(values, index=self.index, columns=self.tickers)
+        return result
+
+    def pairwise(self, window: int, min_periods: int = None) -> np.ndarray:
+        """Rolling correlation of every ticker pair, (dates x tickers x tickers).
+
+        The N x N products are kept per date, so memory grows with dates x tickers ** 2.
+        """
+        valid = ~np.isnan(self.returns)
+        x = np.where(valid, self.returns - np.nanmean(self.returns, axis=0), 0.0)
+        both = (valid[:, :, np.newaxis] & valid[:, np.newaxis, :]).astype(np.float64)
+        counts = RollingWindow.sums(both, window)
+        # each side's sums are taken over the dates the pair shares
+        sum_x = RollingWindow.sums(x[:, :, np.newaxis] * both, window)
+        sum_y = np.swapaxes(sum_x, 1, 2)
+        squares = x * x
+        sum_xx = RollingWindow.sums(squares[:, :, np.newaxis] * both, window)
+        sum_yy = np.swapaxes(sum_xx, 1, 2)
+        sum_xy = RollingWindow.sums(x[:, :, np.newaxis] * x[:, np.newaxis, :], window)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            covariance = sum_xy - sum_x * sum_y / counts
+            variance_x = np.maximum(sum_xx - sum_x * sum_x / counts, 0.0)
+            variance_y = np.maximum(sum_yy - sum_y * sum_y / counts, 0.0)
+            result = covariance / np.sqrt(variance_x * variance_y)
+        result[counts < max(window if min_periods is None else min_periods, 2)] = np.nan
+        return result
@@ -0,0 +1,110 @@
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RecursiveFilter(object):
+    """Vectorized first-order IIR filter shared by the EMA, SMMA and KDJ calculations.
+
+    All functions work along axis 0, so both a single series and a (rows x columns) matrix
+    are filtered in one call.
+    """
+
+    # upper bound of decay ** -block, keeps the closed form inside the float range
+    SCALE_LIMIT = 1e100
+    # scipy.signal.lfilter, False without scipy. Importing scipy.signal takes about a second,
+    # so it is only done on the first call
+    _lfilter = None
+
+    @staticmethod
+    def lfilter():
+        if RecursiveFilter._lfilter is None:
+            try:
+                from scipy.signal import lfilter
+            except ImportError:
+                lfilter = False
+            RecursiveFilter._lfilter = lfilter
+        return RecursiveFilter._lfilter
+
+    @staticmethod
+    def first_order(values, decay: float, gain: float = 1.0, initial: float = 0.0):
+        """Return y where y[t] = decay * y[t - 1] + gain * x[t] and y[-1] = initial.
+
+        NaN inputs propagate to every later output, as with `lfilter`.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return values.copy()
+        lfilter = RecursiveFilter.lfilter()
+        if lfilter:
+            state = np.full((1,) + values.shape[1:], decay * initial)
+            result, _ = lfilter([gain], [1.0, -decay], values, axis=0, zi=state)
+            return result
+        return RecursiveFilter._first_order_blocked(values, decay, gain, initial)
+
+    @staticmethod
+    def ewm_mean(values, alpha: float, min_periods: int = 0):
+        """Exponentially weighted mean, same as `ewm(alpha=alpha, adjust=True, ignore_na=False).mean()`.
+
+        The adjusted mean is the ratio of two first-order filters, the weighted sum of the
+        observations and the weighted count. NaN and infinite observations add nothing to either
+        sum but still decay the older weights, as pandas skips both.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if len(values) == 0:
+            return values.copy()
+        valid = np.isfinite(values)
+        decay = 1.0 - alpha
+        weighted = RecursiveFilter.first_order(np.where(valid, values, 0.0), decay)
+        weights = RecursiveFilter.first_order(valid.astype(np.float64), decay)
+        observations = np.cumsum(valid, axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = weighted / weights
+        # a missing observation repeats the previous mean, this also covers alpha == 1
+        positions = np.arange(len(values)).reshape((-1,) + (1,) * (values.ndim - 1))
+        latest = np.maximum.accumulate(np.where(valid, positions, 0), axis=0)
+        result = np.take_along_axis(result, latest, axis=0)
+        result[observations < max(min_periods, 1)] = np.nan
+        return result
+
+    @staticmethod
+    def ema(values, span: float, min_periods: int = 0):
+        return RecursiveFilter.ewm_mean(values, 2.0 / (span + 1.0), min_periods)
+
+    @staticmethod
+    def smma(values, window: int, min_periods: int = 0):
+        return RecursiveFilter.ewm_mean(values, 1.0 / window, min_periods)
+
+    @staticmethod
+    def _first_order_blocked(values, decay, gain, initial):
+        """Closed form without scipy: inside a block y[j] = decay ** j * (decay * y_prev + cumsum(gain * x * decay ** -k)).
+
+        The block length is chosen so that decay ** -block stays finite, the loop only runs
+        once per block.
+        """
+        if decay == 0:
+            return gain * values
+        size = len(values)
+        if decay == 1:
+            block = size
+        else:
+            block = int(np.log(RecursiveFilter.SCALE_LIMIT) / -np.log(abs(decay)))
+            block = max(1, min(size, block))
+
+        powers = decay ** np.arange(block, dtype=np.float64)
+        inverse = 1.0 / powers
+        shape = (-1,) + (1,) * (values.ndim - 1)
+        powers = powers.reshape(shape)
+        inverse = inverse.reshape(shape)
+
+        result = np.empty_like(values)
+        previous = np.full(values.shape[1:], float(initial))
+        for start in range(0, size, block):
+            chunk = values[start:start + block]
+            length = len(chunk)
+            scaled = np.cumsum(gain * chunk * inverse[:length], axis=0)
+            result[start:start + length] = powers[:length] * (decay * previous + scaled)
+            previous = result[start + length - 1]
+        return result
@@ -1,16 +1,30 @@
 import abc
 import logging
+from collections import OrderedDict
 
+import numpy as np
 import pandas as pd
-from PortfolioBasic.stockstats import StockDataFrame
 
 from PortfolioBasic.Definitions import HeaderFactory
-from PortfolioBasic.Technical.Analysis import TechnicalPerformance
+from PortfolioBasic.Instrumentation import tracer
+from PortfolioBasic.Technical.Cache import IndicatorCache
+from PortfolioBasic.Technical.Correlation import RollingCorrelation
+from PortfolioBasic.Technical.Filters import RecursiveFilter
+from PortfolioBasic.Technical.Panel import MarketPanel
+from PortfolioBasic.Technical.Planner import ColumnPlan
+from PortfolioBasic.Technical.Rolling import RollingWindow
+from PortfolioBasic.Technical.Streaming import IndicatorState, MomentumState, WilliamsState, \
+    CommodityChannelState, TrixState, AverageTrueRangeState, DirectionalIndexState, BollingerState, RsiState, \
+    MacdState, BetaState, CombinedState
 logger = logging.getLogger(__name__)
 
 
-class Indicator(object):
-    __metaclass__ = abc.ABCMeta
+class Indicator(abc.ABC):
+
+    # incremental state used by update(), created on the first bar
+    state = None
+    # EMA/SMMA based, every value depends on the whole history
+    recursive = False
 
     @abc.abstractmethod
     def calculate(self, data: pd.DataFrame)-> pd.DataFrame:
@@ -20,22 +34,160 @@ class Indicator(object):
     def required_days(self) -> int:
         pass
 
+    def warmup_days(self, convergence: int) -> int:
+        """Rows of history needed before the first value matches a full history calculation.
+
+        Recursive (EMA/SMMA) indicators never forget their start, they add `convergence` rows
+        so the start-up effect has decayed.
+        """
+        if self.recursive:
+            return self.required_days() + convergence
+        return self.required_days()
+
+    def stock_columns(self) -> dict:
+        """Return the stockstats columns the indicator reads, mapped to its result columns."""
+        return {}
+
+    def from_stock(self, values: pd.DataFrame) -> pd.DataFrame:
+        """Build the indicator result from already evaluated stockstats columns."""
+        columns = self.stock_columns()
+        return values[list(columns)].rename(columns=columns)
+
+    @abc.abstractmethod
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        """Calculate the indicator for all tickers of the panel in one vectorized pass.
+
+        Returns a (dates x tickers) frame per indicator column.
+        """
+        pass
+
+    @abc.abstractmethod
+    def create_state(self) -> IndicatorState:
+        pass
+
+    def update(self, bar) -> pd.Series:
+        """Append one bar (Open/High/Low/Close values) and return the latest indicator row.
+
+        Only the indicator state is advanced, EMA based indicators keep O(1) state and rolling
+        ones a ring buffer of their window.
+        """
+        if self.state is None:
+            self.state = self.create_state()
+        return pd.Series(self.state.update(bar), name=getattr(bar, 'name', None))
+
+    def reset(self):
+        self.state = None
+
+    def prime(self, data: pd.DataFrame) -> pd.Series:
+        """Rebuild the incremental state from the history in `data` and return its last row."""
+        self.state = self.create_state()
+        values = None
+        for bar in data.to_dict('records'):
+            values = self.state.update(bar)
+        return pd.Series(values, name=data.index[-1] if len(data) > 0 else None)
+
+
+class StockIndicator(Indicator):
+    """Indicator computed by stockstats, evaluated through a ColumnPlan."""
+
+    def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
+        return self.from_stock(ColumnPlan(self.stock_columns(), scratch=True).evaluate(data))
+
 
 class CombinedIndicator(Indicator):
 
     def required_days(self) -> int:
         return max(self.indicators, key=lambda x: x.required_days()).required_days()
 
+    def warmup_days(self, convergence: int) -> int:
+        return max(indicator.warmup_days(convergence) for indicator in self.indicators)
+
     def __init__(self, indicators: list):
         self.indicators = indicators
 
     def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
-        result = pd.DataFrame(index=data.index)
+        # stockstats columns of all indicators share one copy, so common intermediates are computed once
+        groups = [(type(indicator).__name__, list(indicator.stock_columns())) for indicator in self.indicators
+                  if indicator.stock_columns()]
+        values = None
+        if groups:
+            keys = [key for _, columns in groups for key in columns]
+            # each indicator's span covers the evaluation of its own columns, nested in this one
+            with tracer.span('stockstats', rows=len(data), columns=len(keys)):
+                values = ColumnPlan(keys, scratch=True).evaluate(data, groups)
+
+        results = [pd.DataFrame(index=data.index)]
         for indicator in self.indicators:
-            indicator_result = indicator.calculate(data)
-            result = result.join(indicator_result)
+            if indicator.stock_columns():
+                results.append(indicator.from_stock(values))
+            else:
+                with tracer.span(type(indicator).__name__, rows=len(data)):
+                    results.append(indicator.calculate(data))
+        return pd.concat(results, axis=1)
+
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        result = OrderedDict()
+        for indicator in self.indicators:
+            result.update(indicator.calculate_panel(panel))
+        return result
+
+    def create_state(self) -> IndicatorState:
+        # update() goes through the indicators, which may prepare the bar for their state
+        return CombinedState([indicator.create_state() for indicator in self.indicators])
+
+    def update(self, bar) -> pd.Series:
+        result = pd.concat([indicator.update(bar) for indicator in self.indicators])
+        result.name = getattr(bar, 'name', None)
         return result
 
+    def reset(self):
+        for indicator in self.indicators:
+            indicator.reset()
+
+    def prime(self, data: pd.DataFrame) -> pd.Series:
+        return pd.concat([indicator.prime(data) for indicator in self.indicators])
+
+
+class CachedIndicator(Indicator):
+    """Serves the results of the wrapped indicator from an IndicatorCache."""
+
+    def __init__(self, indicator: Indicator, cache: IndicatorCache):
+        self.indicator = indicator
+        self.cache = cache
+
+    def required_days(self) -> int:
+        return self.indicator.required_days()
+
+    def warmup_days(self, convergence: int) -> int:
+        return self.indicator.warmup_days(convergence)
+
+    def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
+        with tracer.span('indicator_cache', rows=len(data)) as span:
+            key = self.cache.key(self.indicator, data)
+            result = self.cache.get(key)
+            span.set(hit=result is not None)
+            if result is None:
+                result = self.indicator.calculate(data)
+                self.cache.put(key, result)
+            else:
+                logger.debug("Indicator %s loaded from cache", type(self.indicator).__name__)
+        return result
+
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        return self.indicator.calculate_panel(panel)
+
+    def create_state(self) -> IndicatorState:
+        return self.indicator.create_state()
+
+    def update(self, bar) -> pd.Series:
+        return self.indicator.update(bar)
+
+    def reset(self):
+        self.indicator.reset()
+
+    def prime(self, data: pd.DataFrame) -> pd.Series:
+        return self.indicator.prime(data)
+
 
 class MomentumIndicator(Indicator):
 
@@ -52,75 +204,144 @@ class MomentumIndicator(Indicator):
         result = pd.DataFrame(index=data.index, data=data.values, columns=['{}_{}'.format(HeaderFactory.MOM, self.days)])
         return result
 
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        close = panel[HeaderFactory.Price]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = close / MarketPanel.shift(close, self.days) - 1
+        return OrderedDict([('{}_{}'.format(HeaderFactory.MOM, self.days), panel.wrap(value))])
 
-class Williams(Indicator):
+    def create_state(self) -> IndicatorState:
+        return MomentumState(self.days, '{}_{}'.format(HeaderFactory.MOM, self.days))
+
+
+class Williams(StockIndicator):
     def __init__(self):
         self.windows = 10
 
     def required_days(self) -> int:
         return self.windows
 
-    def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
-        stock = StockDataFrame.retype(data.copy())
-        wr_10 = stock['wr_10']
-        result = pd.DataFrame(index=wr_10.index, data=wr_10.values, columns=['wr_10'])
-        return result
+    def stock_columns(self) -> dict:
+        return {'wr_10': 'wr_10'}
+
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        low = MarketPanel.rolling(panel[HeaderFactory.Low], self.windows, 1).min().values
+        high = MarketPanel.rolling(panel[HeaderFactory.High], self.windows, 1).max().values
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = (high - panel[HeaderFactory.Price]) / (high - low) * 100
+        return OrderedDict([('wr_10', panel.wrap(value))])
+
+    def create_state(self) -> IndicatorState:
+        return WilliamsState(self.windows, 'wr_10')
 
 
-class CommodityChannelIndex(Indicator):
+class CommodityChannelIndex(StockIndicator):
     def __init__(self):
         self.windows = 14
 
     def required_days(self) -> int:
         return self.windows
 
-    def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
-        stock = StockDataFrame.retype(data.copy())
-        value = stock['cci']
-        result = pd.DataFrame(index=value.index, data=value.values, columns=['cci'])
-        return result
+    def stock_columns(self) -> dict:
+        return {'cci': 'cci'}
+
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        typical = (panel[HeaderFactory.Price] + panel[HeaderFactory.High] + panel[HeaderFactory.Low]) / 3.0
+        average = MarketPanel.rolling(typical, self.windows, 1).mean().values
+        deviation = RollingWindow.mean_absolute_deviation(typical, self.windows, min_periods=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = (typical - average) / (.015 * deviation)
+        return OrderedDict([('cci', panel.wrap(value))])
+
+    def create_state(self) -> IndicatorState:
+        return CommodityChannelState(self.windows, 'cci')
+
 
+class TripleExponentialMovingAverage(StockIndicator):
+    recursive = True
 
-class TripleExponentialMovingAverage(Indicator):
     def __init__(self):
         self.windows = 12
 
     def required_days(self) -> int:
         return self.windows
 
-    def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
-        stock = StockDataFrame.retype(data.copy())
-        value = stock['trix']
-        result = pd.DataFrame(index=value.index, data=value.values, columns=['trix'])
-        return result
+    def stock_columns(self) -> dict:
+        return {'trix': 'trix'}
+
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        ema = panel[HeaderFactory.Price]
+        for _ in range(3):
+            ema = RecursiveFilter.ema(ema, self.windows)
+        previous = MarketPanel.shift(ema, 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = (ema - previous) * 100 / previous
+        return OrderedDict([('trix', panel.wrap(value))])
+
+    def create_state(self) -> IndicatorState:
+        return TrixState(self.windows, 'trix')
+
 
+class AverageTrueRange(StockIndicator):
+    recursive = True
 
-class AverageTrueRange(Indicator):
     def __init__(self):
         self.windows = 12
 
     def required_days(self) -> int:
         return self.windows
 
-    def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
-        stock = StockDataFrame.retype(data.copy())
-        value = stock['atr']
-        result = pd.DataFrame(index=value.index, data=value.values, columns=['atr'])
-        return result
+    def stock_columns(self) -> dict:
+        return {'atr': 'atr'}
+
+    @staticmethod
+    def true_range(panel: MarketPanel) -> np.ndarray:
+        high, low = panel[HeaderFactory.High], panel[HeaderFactory.Low]
+        previous = MarketPanel.shift(panel[HeaderFactory.Price], 1)
+        return np.max((high - low, np.abs(high - previous), np.abs(low - previous)), axis=0)
+
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        value = RecursiveFilter.smma(self.true_range(panel), 14)
+        return OrderedDict([('atr', panel.wrap(value))])
+
+    def create_state(self) -> IndicatorState:
+        # stockstats 'atr' is the 14 days SMMA of the true range
+        return AverageTrueRangeState(14, 'atr')
 
 
-class AverageDirectionalIndex(Indicator):
+class AverageDirectionalIndex(StockIndicator):
+    recursive = True
+
     def __init__(self):
         self.windows = 6
 
     def required_days(self) -> int:
         return self.windows
 
-    def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
-        stock = StockDataFrame.retype(data.copy())
-        value = stock['adx']
-        result = pd.DataFrame(index=value.index, data=value.values, columns=['adx'])
-        return result
+    def stock_columns(self) -> dict:
+        return {'adx': 'adx'}
+
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        high, low = panel[HeaderFactory.High], panel[HeaderFactory.Low]
+        up_move = high - MarketPanel.shift(high, 1)
+        up_move = (up_move + np.abs(up_move)) / 2
+        down_move = MarketPanel.shift(low, 1) - low
+        down_move = (down_move + np.abs(down_move)) / 2
+        # rows before the listing date must not feed zeros into the averages
+        listed = panel.listed()
+        with np.errstate(invalid='ignore'):
+            pdm = np.where(listed, np.where(up_move > down_move, up_move, 0), np.nan)
+            mdm = np.where(listed, np.where(down_move > up_move, down_move, 0), np.nan)
+        atr = RecursiveFilter.smma(AverageTrueRange.true_range(panel), 14)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pdi = RecursiveFilter.ema(pdm, 14) / atr * 100
+            mdi = RecursiveFilter.ema(mdm, 14) / atr * 100
+            dx = np.abs(pdi - mdi) / (pdi + mdi) * 100
+        return OrderedDict([('adx', panel.wrap(RecursiveFilter.ema(dx, self.windows)))])
+
+    def create_state(self) -> IndicatorState:
+        # stockstats 'adx' is the 6 days EMA of the 14 days DX
+        return DirectionalIndexState(14, self.windows, 'adx')
 
 
 class BollingerIndicator(Indicator):
@@ -131,31 +352,114 @@ class BollingerIndicator(Indicator):
     def required_days(self) -> int:
         return self.windows
 
+    def value(self, close: np.ndarray) -> np.ndarray:
+        bands = RollingWindow.bollinger(close, self.windows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (close - bands['mean']) / (2 * bands['std'])
+
     def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
-        data = data[HeaderFactory.Price].copy()
-        rm, rstd = TechnicalPerformance.compute_std(data, self.windows)
-        result = (data - rm) / (2 * rstd)
-        result = pd.DataFrame(index=result.index, data=result.values, columns=[HeaderFactory.Bollinger])
-        return result
+        return pd.DataFrame(index=data.index, data=self.value(data[HeaderFactory.Price].values),
+                            columns=[HeaderFactory.Bollinger])
 
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        return OrderedDict([(HeaderFactory.Bollinger, panel.wrap(self.value(panel[HeaderFactory.Price])))])
 
-class RsiIndicator(Indicator):
+    def create_state(self) -> IndicatorState:
+        return BollingerState(self.windows, HeaderFactory.Bollinger)
+
+
+class BetaIndicator(Indicator):
+    """Rolling beta and correlation of the daily returns against a benchmark price series."""
+
+    def __init__(self, benchmark: pd.Series, windows=60):
+        self.benchmark = benchmark
+        self.windows = windows
+        self._returns = None
 
     def required_days(self) -> int:
-        return 15
+        return self.windows + 1
+
+    def columns(self) -> list:
+        return ['{}_{}'.format(HeaderFactory.BETA, self.windows), '{}_{}'.format(HeaderFactory.CORR, self.windows)]
+
+    def values(self, close: pd.DataFrame) -> tuple:
+        """(beta, correlation) of every column of `close`."""
+        engine = RollingCorrelation.from_prices(close, self.benchmark.to_frame('benchmark'))
+        covariance, variance, benchmark_variance = engine.moments('benchmark', self.windows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return covariance / benchmark_variance, covariance / np.sqrt(variance * benchmark_variance)
 
     def calculate(self, data: pd.DataFrame) -> pd.DataFrame:
-        data = pd.DataFrame(data[HeaderFactory.Price])
-        data = data.rename(index=str, columns={HeaderFactory.Price: "close"})
-        stock = StockDataFrame.retype(data)
-        rsi = stock['rsi_14']
-        rsi /= 100
-        data = rsi
-        result = pd.DataFrame(index=data.index, data=data.values, columns=[HeaderFactory.RSI])
-        return result
+        beta, correlation = self.values(data[[HeaderFactory.Price]])
+        return pd.DataFrame(np.hstack([beta, correlation]), index=data.index, columns=self.columns())
+
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        def returns(prices):
+            with np.errstate(invalid='ignore', divide='ignore'):
+                return prices / MarketPanel.shift(prices, 1) - 1
+
+        # like calculate() the benchmark returns are over its own dates, then taken on each ticker's
+        benchmark = panel.take(self.benchmark_returns(panel.index))
+        covariance, variance, benchmark_variance = RollingCorrelation.rolling_moments(
+            returns(panel[HeaderFactory.Price]), benchmark, self.windows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            values = covariance / benchmark_variance, covariance / np.sqrt(variance * benchmark_variance)
+        return OrderedDict((name, panel.wrap(value)) for name, value in zip(self.columns(), values))
+
+    def benchmark_returns(self, index: pd.DatetimeIndex) -> np.ndarray:
+        """Daily benchmark returns on the dates of `index`, NaN where the benchmark has none."""
+        if self._returns is None:
+            self._returns = self.benchmark / self.benchmark.shift(1) - 1
+        return self._returns.reindex(RollingCorrelation.align(self._returns.index, index)).values
+
+    def create_state(self) -> IndicatorState:
+        return BetaState(self.windows, *self.columns())
+
+    def update(self, bar) -> pd.Series:
+        """As `Indicator.update`, the benchmark return is looked up by the date in the bar's name.
+
+        A bar already holding a `BetaState.BENCHMARK` return is used as it is.
+        """
+        if BetaState.BENCHMARK not in bar:
+            date = getattr(bar, 'name', None)
+            if date is None:
+                raise ValueError("{} needs dated bars, a Series named by its date, or a '{}' return".format(
+                    type(self).__name__, BetaState.BENCHMARK))
+            bar = bar.copy()
+            bar[BetaState.BENCHMARK] = self.benchmark_returns(pd.DatetimeIndex([date]))[0]
+        return super(BetaIndicator, self).update(bar)
+
+    def prime(self, data: pd.DataFrame) -> pd.Series:
+        return super(BetaIndicator, self).prime(data.assign(**{BetaState.BENCHMARK: self.benchmark_returns(data.index)}))
+
+
+class RsiIndicator(StockIndicator):
+    recursive = True
+
+    def required_days(self) -> int:
+        return 15
+
+    def stock_columns(self) -> dict:
+        return {'rsi_14': HeaderFactory.RSI}
+
+    def from_stock(self, values: pd.DataFrame) -> pd.DataFrame:
+        return super(RsiIndicator, self).from_stock(values) / 100
+
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        close = panel[HeaderFactory.Price]
+        change = close - MarketPanel.shift(close, 1)
+        gain = RecursiveFilter.smma((change + np.abs(change)) / 2, 14)
+        loss = RecursiveFilter.smma((-change + np.abs(change)) / 2, 14)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = (100 - 100 / (1.0 + gain / loss)) / 100
+        return OrderedDict([(HeaderFactory.RSI, panel.wrap(value))])
+
+    def create_state(self) -> IndicatorState:
+        return RsiState(14, HeaderFactory.RSI)
 
 
 class MACDIndicator(Indicator):
+    recursive = True
 
     def __init__(self):
         self.n_fast = 12
@@ -185,3 +489,15 @@ class MACDIndicator(Indicator):
         data = data.join(MACDdiff)
         return data
 
+    def calculate_panel(self, panel: MarketPanel) -> OrderedDict:
+        close = panel[HeaderFactory.Price]
+        fast = RecursiveFilter.ema(close, self.n_fast, self.n_slow - 1)
+        slow = RecursiveFilter.ema(close, self.n_slow, self.n_slow - 1)
+        macd = fast - slow
+        signal = RecursiveFilter.ema(macd, self.signal_period, self.signal_period - 1)
+        return OrderedDict([(HeaderFactory.MACD, panel.wrap(macd)),
+                            (HeaderFactory.MACD_SIGNAL, panel.wrap(signal)),
+                            (HeaderFactory.MACD_DIFF, panel.wrap(macd - signal))])
+
+    def create_state(self) -> IndicatorState:
+        return MacdState(self.n_fast, self.n_slow, self.signal_period)
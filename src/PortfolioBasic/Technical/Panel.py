@@ -0,0 +1,106 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from PortfolioBasic.Definitions import HeaderFactory
+
+logger = logging.getLogger(__name__)
+
+
+class MarketPanel(object):
+    """Prices of many tickers, a (rows x tickers) matrix per field, on one output date index.
+
+    A ticker's rows before its first valid value (listing date) are NaN, indicators computed on
+    the panel skip them. When the tickers trade on different dates each column holds the bars
+    of its own ticker in order, padded with NaN at the end, and `rows` maps them to `index`.
+    Every column then matches the single ticker result over its own history, a date missing
+    for one ticker is not a NaN bar of it. `wrap` places the results on `index`.
+    """
+
+    def __init__(self, fields: dict, index=None, tickers=None, rows: np.ndarray = None):
+        first = next(iter(fields.values()))
+        if index is None:
+            index = first.index if isinstance(first, pd.DataFrame) else pd.RangeIndex(len(first))
+        if tickers is None:
+            tickers = first.columns if isinstance(first, pd.DataFrame) else pd.RangeIndex(first.shape[1])
+        self.index = index
+        self.tickers = tickers
+        # rows[i, j] is the position in `index` of the i-th bar of ticker j, -1 after its last
+        # bar, None when every ticker has a bar on every date
+        self.rows = rows
+        self.shape = (len(index) if rows is None else len(rows), len(tickers))
+        self.fields = OrderedDict()
+        for name, values in fields.items():
+            values = np.asarray(values, dtype=np.float64)
+            if values.shape != self.shape:
+                raise ValueError("Field {} has shape {}, expected {}".format(name, values.shape, self.shape))
+            self.fields[name] = values
+
+    @staticmethod
+    def from_frames(frames: dict, fields=HeaderFactory.Columns):
+        """Combine single ticker price frames, {ticker: DataFrame}, results go on the union of their dates."""
+        frames = OrderedDict((ticker, frame.sort_index()) for ticker, frame in frames.items())
+        index = None
+        for frame in frames.values():
+            index = frame.index if index is None else index.union(frame.index)
+        tickers = list(frames)
+        rows = None
+        if not all(frame.index.equals(index) for frame in frames.values()):
+            rows = np.full((max(len(frame) for frame in frames.values()), len(tickers)), -1, dtype=np.int64)
+            for column, frame in enumerate(frames.values()):
+                rows[:len(frame), column] = index.get_indexer(frame.index)
+        panel = OrderedDict()
+        for field in fields:
+            if all(field in frame.columns for frame in frames.values()):
+                values = np.full((len(index) if rows is None else len(rows), len(tickers)), np.nan)
+                for column, frame in enumerate(frames.values()):
+                    values[:len(frame), column] = frame[field].values
+                panel[field] = values
+        return MarketPanel(panel, index, pd.Index(tickers), rows)
+
+    def take(self, values) -> np.ndarray:
+        """Spread a value per date of `index` over the panel rows of every ticker."""
+        values = np.asarray(values, dtype=np.float64)
+        if self.rows is None:
+            return np.repeat(values[:, np.newaxis], len(self.tickers), axis=1)
+        return np.where(self.rows >= 0, values[self.rows], np.nan)
+
+    def __getitem__(self, field) -> np.ndarray:
+        return self.fields[field]
+
+    def listed(self) -> np.ndarray:
+        """Mask of the rows at or after each ticker's first valid value in any field."""
+        present = np.zeros(self.shape, dtype=bool)
+        for values in self.fields.values():
+            present |= ~np.isnan(values)
+        return np.logical_or.accumulate(present, axis=0)
+
+    def wrap(self, values) -> pd.DataFrame:
+        """Frame of panel `values` on the dates of `index`, NaN on the dates a ticker has no bar."""
+        if self.rows is None:
+            return pd.DataFrame(values, index=self.index, columns=self.tickers)
+        values = np.asarray(values)
+        present = self.rows >= 0
+        result = np.full((len(self.index), len(self.tickers)), np.nan)
+        columns = np.broadcast_to(np.arange(len(self.tickers)), self.rows.shape)
+        result[self.rows[present], columns[present]] = values[present]
+        return pd.DataFrame(result, index=self.index, columns=self.tickers)
+
+    @staticmethod
+    def shift(values: np.ndarray, periods: int) -> np.ndarray:
+        """Shift rows down by `periods` (up if negative), filling with NaN like `DataFrame.shift`."""
+        result = np.full(values.shape, np.nan)
+        if periods == 0:
+            result[:] = values
+        elif periods > 0:
+            result[periods:] = values[:-periods]
+        else:
+            result[:periods] = values[-periods:]
+        return result
+
+    @staticmethod
+    def rolling(values: np.ndarray, window: int, min_periods=None):
+        """pandas rolling over every column at once."""
+        return pd.DataFrame(values).rolling(window=window, min_periods=min_periods, center=False)
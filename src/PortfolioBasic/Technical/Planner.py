@@ -0,0 +1,233 @@
+import logging
+import time
+from collections import OrderedDict, Counter
+
+import numpy as np
+import pandas as pd
+
+from PortfolioBasic.Instrumentation import Tracer, tracer
+from PortfolioBasic.stockstats import StockDataFrame
+
+logger = logging.getLogger(__name__)
+
+
+class ColumnGraph(object):
+    """Dependency DAG of stockstats columns, recorded while they are evaluated on a shared frame.
+
+    Intermediates which stockstats would delete are kept as scratch columns, so each one is
+    computed exactly once however many requested columns depend on it.
+    """
+
+    def __init__(self):
+        self.dependencies = OrderedDict()
+        self.evaluations = Counter()
+        self.scratch = []
+        self._stack = []
+
+    def enter(self, key):
+        self.evaluations[key] += 1
+        self.dependencies.setdefault(key, [])
+        self._stack.append(key)
+
+    def leave(self, key):
+        self._stack.pop()
+
+    def use(self, key):
+        if not self._stack or not isinstance(key, str):
+            return
+        current = self._stack[-1]
+        if key != current and key not in self.dependencies[current]:
+            self.dependencies[current].append(key)
+
+    def retain(self, key):
+        if key not in self.scratch:
+            self.scratch.append(key)
+
+    def order(self) -> list:
+        """Return the evaluated columns, every column after all of its dependencies."""
+        ordered = []
+        visited = set()
+
+        def visit(key):
+            if key in visited:
+                return
+            visited.add(key)
+            for dependency in self.dependencies.get(key, []):
+                visit(dependency)
+            if key in self.dependencies:
+                ordered.append(key)
+
+        for item in self.dependencies:
+            visit(item)
+        return ordered
+
+
+class ScratchStore(object):
+    """Arrays of the stockstats intermediates of one evaluation, released by reference count.
+
+    Each intermediate holds one reference per column reading it, taken from the dependencies
+    recorded by an earlier evaluation of the same columns. Computing a column releases the
+    references it held, an intermediate is dropped once none are left. Only the `outputs`
+    are written to the frame, so it is not reallocated for every temporary column.
+    """
+
+    def __init__(self, dependencies: dict, outputs):
+        self.dependencies = dependencies
+        self.outputs = set(outputs)
+        self.references = Counter()
+        for key, used in dependencies.items():
+            for column in used:
+                if isinstance(column, str):
+                    self.references[column] += 1
+        self.arrays = OrderedDict()
+        self.bytes = 0
+        # largest total of intermediates held at once
+        self.peak = 0
+        self.stored = 0
+        self.released = 0
+        self._stack = []
+
+    def __contains__(self, key):
+        return key in self.arrays
+
+    def get(self, key) -> np.ndarray:
+        return self.arrays[key]
+
+    def holds(self, key) -> bool:
+        return key not in self.outputs
+
+    def put(self, key, value):
+        values = value.values if isinstance(value, pd.Series) else np.asarray(value)
+        self._drop(key)
+        self.arrays[key] = values
+        self.bytes += values.nbytes
+        self.peak = max(self.peak, self.bytes)
+        self.stored += 1
+
+    def planned(self, key) -> bool:
+        """Whether the recorded dependencies know the column, stockstats' random temporary names are unknown."""
+        return key in self.dependencies or key in self.references
+
+    def delete(self, key):
+        # planned intermediates go with their last reader, unplanned ones once stockstats deletes them
+        if not self.planned(key):
+            self._drop(key)
+
+    def enter(self, key):
+        self._stack.append(key)
+
+    def leave(self, key):
+        self._stack.pop()
+        for column in self.dependencies.get(key, ()):
+            if isinstance(column, str):
+                self.references[column] -= 1
+        for column in [column for column in self.arrays if self.planned(column)
+                       and self.references[column] <= 0 and column not in self._stack]:
+            self._drop(column)
+            self.released += 1
+
+    def clear(self):
+        self.arrays.clear()
+        self.bytes = 0
+
+    def _drop(self, key):
+        values = self.arrays.pop(key, None)
+        if values is not None:
+            self.bytes -= values.nbytes
+
+
+class ColumnPlan(object):
+    """Evaluates the stockstats columns of several indicators on one shared copy of the data.
+
+    With `scratch` the intermediates are kept in a ScratchStore instead of the frame. The
+    store needs the column dependencies, they only depend on the requested columns and are
+    recorded once per set of columns on the first PLAN_ROWS rows.
+    """
+
+    PLAN_ROWS = 32
+    # {requested columns: dependencies}, shared by all plans
+    _dependencies = {}
+
+    def __init__(self, keys, scratch: bool = False):
+        self.keys = list(OrderedDict.fromkeys(keys))
+        self.scratch = scratch
+        self.graph = None
+        self.store = None
+
+    def evaluate(self, data: pd.DataFrame, groups=None) -> pd.DataFrame:
+        """Evaluate the columns, `groups` of (name, keys) are each read inside a tracer span of that name.
+
+        An intermediate shared by several groups is charged to the first group reading it.
+        """
+        if self.scratch and len(data) > 0:
+            return self._evaluate_scratch(data, groups)
+        stock = StockDataFrame.retype(data.copy())
+        graph = ColumnGraph()
+        stock.track(graph)
+        try:
+            columns = self._read(stock, groups)
+        finally:
+            stock.track(None)
+
+        self.graph = graph
+        repeated = [key for key, total in graph.evaluations.items() if total > 1]
+        if repeated:
+            logger.warning("Columns evaluated more than once: %s", repeated)
+        logger.debug("Evaluated %i columns for %i requested", len(graph.evaluations), len(self.keys))
+        return pd.DataFrame(columns, index=stock.index)
+
+    def dependencies(self, data: pd.DataFrame) -> dict:
+        key = tuple(self.keys)
+        dependencies = ColumnPlan._dependencies.get(key)
+        if dependencies is None:
+            plan = ColumnPlan(self.keys)
+            plan.evaluate(data.iloc[:self.PLAN_ROWS])
+            dependencies = ColumnPlan._dependencies[key] = plan.graph.dependencies
+        return dependencies
+
+    def _read(self, stock: StockDataFrame, groups) -> OrderedDict:
+        columns = OrderedDict()
+        for name, keys in groups or ():
+            with tracer.span(name, rows=len(stock), columns=len(keys)):
+                for key in keys:
+                    if key not in columns:
+                        columns[key] = stock.raw(key)
+        for key in self.keys:
+            if key not in columns:
+                columns[key] = stock.raw(key)
+        return OrderedDict((key, columns[key]) for key in self.keys)
+
+    def _evaluate_scratch(self, data: pd.DataFrame, groups=None) -> pd.DataFrame:
+        store = ScratchStore(self.dependencies(data), self.keys)
+        stock = StockDataFrame.retype(data.copy())
+        stock.scratch(store)
+        try:
+            columns = self._read(stock, groups)
+        finally:
+            stock.scratch(None)
+            store.clear()
+
+        self.store = store
+        logger.debug("Evaluated %i columns for %i requested, %i intermediates peaking at %i bytes",
+                     store.stored + len(self.keys), len(self.keys), store.stored, store.peak)
+        return pd.DataFrame(columns, index=stock.index)
+
+    @staticmethod
+    def measure(data: pd.DataFrame, keys, scratch: bool = True) -> OrderedDict:
+        """Seconds and peak Python allocations of evaluating `keys`, to compare the two modes.
+
+        The time is taken on a run without memory tracing, which slows allocations down.
+        """
+        ColumnPlan(keys, scratch).evaluate(data.iloc[:ColumnPlan.PLAN_ROWS])
+        start = time.perf_counter()
+        ColumnPlan(keys, scratch).evaluate(data)
+        seconds = time.perf_counter() - start
+
+        profiler = Tracer()
+        profiler.enable(memory=True)
+        try:
+            with profiler.span('evaluate') as span:
+                ColumnPlan(keys, scratch).evaluate(data)
+        finally:
+            profiler.disable()
+        return OrderedDict([('seconds', seconds), ('peak', span.peak), ('retained', span.retained)])
@@ -0,0 +1,270 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+from numpy.lib.stride_tricks import as_strided
+
+logger = logging.getLogger(__name__)
+
+
+class RollingWindow(object):
+    """NumPy sliding-window reductions replacing `rolling(...).apply` callbacks.
+
+    Every reduction follows the pandas rolling conventions: the window ends on the current row,
+    NaN values are skipped and rows with fewer than `min_periods` valid observations are NaN.
+    Reductions run along axis 0, so a (dates x tickers) matrix is reduced per column in one call.
+    """
+
+    # values per block, bounds the temporary (block x window) matrices
+    BLOCK_SIZE = 65536
+
+    @staticmethod
+    def sliding(values, window: int):
+        """Return a read-only (n, window, ...) view, row i holding values[i - window + 1: i + 1].
+
+        The first window - 1 rows are padded with NaN, so the view has one row per input value.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        padded = np.empty((len(values) + window - 1,) + values.shape[1:], dtype=np.float64)
+        padded[:window - 1] = np.nan
+        padded[window - 1:] = values
+        stride = padded.strides[0]
+        return as_strided(padded, shape=(len(values), window) + values.shape[1:],
+                          strides=(stride, stride) + padded.strides[1:], writeable=False)
+
+    @staticmethod
+    def reduce(values, window: int, func, min_periods=None):
+        """Apply a row-wise reduction `func(windows, valid)` over all windows, block by block.
+
+        `windows` is a (rows, window, ...) block with NaN replaced by zero and `valid` is its mask,
+        `func` reduces axis 1.
+        """
+        window = int(window)
+        if window <= 0:
+            raise ValueError("window must be greater than 0")
+        if min_periods is None:
+            min_periods = window
+        values = np.asarray(values, dtype=np.float64)
+        result = np.full(values.shape, np.nan)
+        if len(values) == 0:
+            return result
+
+        view = RollingWindow.sliding(values, window)
+        rows = max(1, RollingWindow.BLOCK_SIZE // max(1, values[0].size))
+        for start in range(0, len(values), rows):
+            block = view[start:start + rows]
+            valid = ~np.isnan(block)
+            counts = valid.sum(axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                reduced = func(np.where(valid, block, 0.0), valid)
+            result[start:start + len(block)] = np.where(counts >= max(min_periods, 1), reduced, np.nan)
+        return result
+
+    @staticmethod
+    def mean(values, window: int, min_periods=None):
+        return RollingWindow.reduce(values, window, RollingWindow._mean, min_periods)
+
+    @staticmethod
+    def mean_absolute_deviation(values, window: int, min_periods=None):
+        """Rolling mean absolute deviation around the window mean, as used by CCI."""
+        def mad(block, valid):
+            counts = valid.sum(axis=1)
+            centre = RollingWindow._mean(block, valid)
+            deviation = np.where(valid, np.fabs(block - np.expand_dims(centre, 1)), 0.0)
+            return deviation.sum(axis=1) / counts
+
+        return RollingWindow.reduce(values, window, mad, min_periods)
+
+    @staticmethod
+    def count_nonzero(values, window: int, min_periods=None):
+        """Rolling count of non-zero values, NaN counts as non-zero like `np.count_nonzero`."""
+        values = np.asarray(values, dtype=np.float64)
+        flags = np.where(np.isnan(values), 1.0, (values != 0).astype(np.float64))
+        counts = RollingWindow.reduce(flags, window, lambda block, valid: block.sum(axis=1), 1)
+        # validity is decided on the original values, so NaN windows still honour min_periods
+        present = RollingWindow.reduce((~np.isnan(values)).astype(np.float64), window,
+                                       lambda block, valid: block.sum(axis=1), 1)
+        if min_periods is None:
+            min_periods = window
+        counts[~(present >= max(min_periods, 1))] = np.nan
+        return counts
+
+    @staticmethod
+    def _mean(block, valid):
+        return block.sum(axis=1) / valid.sum(axis=1)
+
+    @staticmethod
+    def moving_sums(values, windows, powers=(1,)):
+        """Rolling sums of (values - centre) ** power for every window and power, in one pass.
+
+        Returns the sums per power, each (windows, n, ...), the valid counts and the centre. All
+        windows are differences of one cumulative sum, the values are centred on their mean so
+        long histories keep a small cancellation error.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        windows = np.asarray(windows, dtype=np.int64)
+        valid = ~np.isnan(values)
+        centre = np.nanmean(values, axis=0) if valid.any() else 0.0
+        centred = np.where(valid, values - centre, 0.0)
+        end = np.arange(1, len(values) + 1)
+        begin = np.maximum(end[np.newaxis, :] - windows[:, np.newaxis], 0)
+        sums = [RollingWindow._differences(centred ** power, end, begin) for power in powers]
+        return sums, RollingWindow._differences(valid, end, begin), centre
+
+    @staticmethod
+    def means(values, windows, min_periods=None):
+        """Rolling means of every window in one pass, (windows, n, ...)."""
+        values = np.asarray(values, dtype=np.float64)
+        (sums,), counts, centre = RollingWindow.moving_sums(values, windows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = sums / counts + centre
+        # like pandas, a window of one repeated value averages to exactly that value
+        result = np.where(RollingWindow.constant(values, windows), values, result)
+        return RollingWindow._require(result, counts, windows, min_periods)
+
+    @staticmethod
+    def stds(values, windows, min_periods=None, ddof: int = 1):
+        """Rolling standard deviations of every window in one pass, (windows, n, ...)."""
+        (sums, squares), counts, _ = RollingWindow.moving_sums(values, windows, (1, 2))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            variance = (squares - sums * sums / counts) / (counts - ddof)
+        result = np.sqrt(np.maximum(variance, 0.0))
+        result[RollingWindow.constant(values, windows)] = 0.0
+        result[counts <= ddof] = np.nan
+        return RollingWindow._require(result, counts, windows, min_periods)
+
+    @staticmethod
+    def bollinger(values, window: int, deviation: float = 2, min_periods=None, ddof: int = 1) -> OrderedDict:
+        """Rolling mean, standard deviation, upper and lower bands and %b of one window.
+
+        The valid counts, centred sums, squared sums and value changes are laid out in one
+        contiguous block and share a single in-place cumulative sum, every window is then a
+        difference of two shifted slices of it. The outputs are derived in place, without the
+        temporaries of separate rolling passes.
+        """
+        window = int(window)
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+        centre = np.nanmean(values, axis=0) if valid.any() else 0.0
+        totals = np.zeros((4, len(values) + 1) + values.shape[1:])
+        totals[0, 1:] = valid
+        np.subtract(values, centre, out=totals[1, 1:])
+        np.copyto(totals[1, 1:], 0.0, where=~valid)
+        np.multiply(totals[1, 1:], totals[1, 1:], out=totals[2, 1:])
+        # NaN compares unequal, so like `constant` a missing value counts as a change
+        np.not_equal(values[1:], values[:-1], out=totals[3, 2:])
+        np.cumsum(totals, axis=1, out=totals)
+        moments = RollingWindow._trailing(totals[:3], window, axis=1)
+        counts, sums, squares = moments
+        # the first value of a window is not a change, a window of one repeated value is constant
+        constant = RollingWindow._trailing(totals[3], window - 1) == 0
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = sums / counts
+            mean += centre
+            std = np.multiply(sums, sums, out=sums)
+            std /= counts
+            np.subtract(squares, std, out=std)
+            std /= counts - ddof
+            np.maximum(std, 0.0, out=std)
+            np.sqrt(std, out=std)
+        # like pandas, a window of one repeated value has exactly that mean and no deviation
+        np.copyto(mean, values, where=constant)
+        std[constant] = 0.0
+        std[counts <= ddof] = np.nan
+        missing = counts < (window if min_periods is None else max(min_periods, 1))
+        mean[missing] = np.nan
+        std[missing] = np.nan
+
+        width = np.multiply(std, deviation, out=squares)
+        upper = mean + width
+        lower = mean - width
+        with np.errstate(invalid='ignore', divide='ignore'):
+            percent_b = np.subtract(values, lower)
+            percent_b /= np.multiply(width, 2, out=width)
+        return OrderedDict([('mean', mean), ('std', std), ('upper', upper), ('lower', lower), ('percent_b', percent_b)])
+
+    @staticmethod
+    def constant(values, windows) -> np.ndarray:
+        """Mask of the windows holding one repeated value, (windows, n, ...)."""
+        values = np.asarray(values, dtype=np.float64)
+        windows = np.asarray(windows, dtype=np.int64)
+        changes = np.zeros(values.shape)
+        with np.errstate(invalid='ignore'):
+            changes[1:] = ~(values[1:] == values[:-1])
+        end = np.arange(1, len(values) + 1)
+        # the first value of a window does not count as a change
+        begin = np.minimum(np.maximum(end[np.newaxis, :] - windows[:, np.newaxis] + 1, 0), end)
+        return RollingWindow._differences(changes, end, begin) == 0
+
+    @staticmethod
+    def maxima(values, windows, min_periods=1):
+        """Rolling maxima of every window, NaN skipped, (windows, n, ...)."""
+        return RollingWindow._extrema(values, windows, min_periods, np.maximum, -np.inf)
+
+    @staticmethod
+    def minima(values, windows, min_periods=1):
+        """Rolling minima of every window, NaN skipped, (windows, n, ...)."""
+        return RollingWindow._extrema(values, windows, min_periods, np.minimum, np.inf)
+
+    @staticmethod
+    def _extrema(values, windows, min_periods, combine, empty):
+        # sparse table: level k holds the extreme of the 2 ** k rows starting at each row, so any
+        # window is covered by two overlapping power of two ranges
+        values = np.asarray(values, dtype=np.float64)
+        windows = np.asarray(windows, dtype=np.int64)
+        valid = ~np.isnan(values)
+        pad = int(windows.max()) - 1
+        level = np.concatenate([np.full((pad,) + values.shape[1:], empty), np.where(valid, values, empty)])
+        levels = [level]
+        span = 1
+        while span * 2 <= windows.max():
+            level = level.copy()
+            combine(level[:-span], level[span:], out=level[:-span])
+            levels.append(level)
+            span *= 2
+
+        end = np.arange(len(values)) + pad
+        result = np.empty((len(windows),) + values.shape)
+        for position, window in enumerate(windows):
+            k = int(window).bit_length() - 1
+            combine(levels[k][end - window + 1], levels[k][end - (1 << k) + 1], out=result[position])
+        counts = RollingWindow._differences(valid, np.arange(1, len(values) + 1),
+                                            np.maximum(np.arange(1, len(values) + 1) - windows[:, np.newaxis], 0))
+        return RollingWindow._require(result, counts, windows, min_periods)
+
+    @staticmethod
+    def sums(values, window: int) -> np.ndarray:
+        """Rolling sums of one window from a cumulative sum, shorter windows at the start."""
+        values = np.asarray(values, dtype=np.float64)
+        totals = np.zeros((len(values) + 1,) + values.shape[1:])
+        np.cumsum(values, axis=0, out=totals[1:])
+        return RollingWindow._trailing(totals, int(window))
+
+    @staticmethod
+    def _trailing(totals, window: int, axis: int = 0) -> np.ndarray:
+        """Window sums from cumulative `totals` starting with a zero row along `axis`, by shifted slices."""
+        def rows(start, stop=None):
+            return (slice(None),) * axis + (slice(start, stop),)
+
+        result = totals[rows(1)].copy()
+        size = result.shape[axis]
+        if window < size:
+            result[rows(window)] -= totals[rows(1, size + 1 - window)]
+        return result
+
+    @staticmethod
+    def _differences(values, end, begin):
+        totals = np.zeros((len(values) + 1,) + values.shape[1:])
+        np.cumsum(values, axis=0, out=totals[1:])
+        return totals[end] - totals[begin]
+
+    @staticmethod
+    def _require(result, counts, windows, min_periods):
+        """NaN where a window has fewer than min_periods (default: the window) valid values."""
+        if min_periods is None:
+            required = np.asarray(windows, dtype=np.float64).reshape((-1,) + (1,) * (result.ndim - 1))
+        else:
+            required = max(min_periods, 1)
+        result[counts < required] = np.nan
+        return result
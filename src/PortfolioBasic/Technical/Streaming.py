@@ -0,0 +1,296 @@
+import abc
+import logging
+from collections import deque, OrderedDict
+
+import numpy as np
+
+from PortfolioBasic.Definitions import HeaderFactory
+
+logger = logging.getLogger(__name__)
+
+
+class ExponentialMean(object):
+    """O(1) state of `ewm(alpha=alpha, adjust=True, ignore_na=False).mean()`."""
+
+    def __init__(self, alpha: float, min_periods: int = 0):
+        self.decay = 1.0 - alpha
+        self.min_periods = max(min_periods, 1)
+        self.weighted = 0.0
+        self.weights = 0.0
+        self.observations = 0
+        self.value = np.nan
+
+    def update(self, value: float) -> float:
+        self.weighted *= self.decay
+        self.weights *= self.decay
+        # pandas skips infinite observations like missing ones
+        if np.isfinite(value):
+            self.weighted += value
+            self.weights += 1.0
+            self.observations += 1
+            self.value = self.weighted / self.weights
+        if self.observations < self.min_periods:
+            return np.nan
+        return self.value
+
+
+class RollingBuffer(object):
+    """Ring buffer over the last `window` values, reductions skip NaN like pandas rolling."""
+
+    def __init__(self, window: int, min_periods=None):
+        self.values = deque(maxlen=window)
+        self.min_periods = max(window if min_periods is None else min_periods, 1)
+
+    def append(self, value: float):
+        self.values.append(value)
+
+    def _valid(self):
+        values = np.fromiter(self.values, dtype=np.float64, count=len(self.values))
+        values = values[~np.isnan(values)]
+        if len(values) < self.min_periods:
+            return None
+        return values
+
+    def mean(self) -> float:
+        values = self._valid()
+        return np.nan if values is None else values.mean()
+
+    def std(self) -> float:
+        values = self._valid()
+        if values is None or len(values) < 2:
+            return np.nan
+        return values.std(ddof=1)
+
+    def min(self) -> float:
+        values = self._valid()
+        return np.nan if values is None else values.min()
+
+    def max(self) -> float:
+        values = self._valid()
+        return np.nan if values is None else values.max()
+
+    def mean_absolute_deviation(self) -> float:
+        values = self._valid()
+        return np.nan if values is None else np.fabs(values - values.mean()).mean()
+
+
+class IndicatorState(abc.ABC):
+    """Incremental state of one indicator, `update` takes a bar and returns the latest values."""
+
+    @staticmethod
+    def price(bar, name=HeaderFactory.Price) -> np.float64:
+        value = bar[name]
+        return np.float64(np.nan if value is None else value)
+
+    @abc.abstractmethod
+    def update(self, bar) -> OrderedDict:
+        pass
+
+
+class CombinedState(IndicatorState):
+    """States of several indicators advanced together, their values merged in order."""
+
+    def __init__(self, states: list):
+        self.states = states
+
+    def update(self, bar) -> OrderedDict:
+        values = OrderedDict()
+        for state in self.states:
+            values.update(state.update(bar))
+        return values
+
+
+class MomentumState(IndicatorState):
+
+    def __init__(self, days: int, column: str):
+        self.prices = deque(maxlen=days + 1)
+        self.column = column
+
+    def update(self, bar) -> OrderedDict:
+        self.prices.append(self.price(bar))
+        value = np.nan
+        if len(self.prices) == self.prices.maxlen:
+            with np.errstate(invalid='ignore', divide='ignore'):
+                value = self.prices[-1] / self.prices[0] - 1
+        return OrderedDict([(self.column, value)])
+
+
+class WilliamsState(IndicatorState):
+
+    def __init__(self, window: int, column: str):
+        self.lows = RollingBuffer(window, 1)
+        self.highs = RollingBuffer(window, 1)
+        self.column = column
+
+    def update(self, bar) -> OrderedDict:
+        self.lows.append(self.price(bar, HeaderFactory.Low))
+        self.highs.append(self.price(bar, HeaderFactory.High))
+        low, high = self.lows.min(), self.highs.max()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = (high - self.price(bar)) / (high - low) * 100
+        return OrderedDict([(self.column, value)])
+
+
+class CommodityChannelState(IndicatorState):
+
+    def __init__(self, window: int, column: str):
+        self.typical = RollingBuffer(window, 1)
+        self.column = column
+
+    def update(self, bar) -> OrderedDict:
+        typical = (self.price(bar) + self.price(bar, HeaderFactory.High) + self.price(bar, HeaderFactory.Low)) / 3.0
+        self.typical.append(typical)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = (typical - self.typical.mean()) / (.015 * self.typical.mean_absolute_deviation())
+        return OrderedDict([(self.column, value)])
+
+
+class TrueRangeState(IndicatorState):
+    """True range of the bar, NaN until the previous close is known."""
+
+    def __init__(self):
+        self.previous_close = np.nan
+
+    def update(self, bar) -> float:
+        high, low = self.price(bar, HeaderFactory.High), self.price(bar, HeaderFactory.Low)
+        previous, self.previous_close = self.previous_close, self.price(bar)
+        ranges = (high - low, abs(high - previous), abs(low - previous))
+        return np.nan if np.isnan(ranges).any() else max(ranges)
+
+
+class TrixState(IndicatorState):
+
+    def __init__(self, window: int, column: str):
+        alpha = 2.0 / (window + 1.0)
+        self.chain = [ExponentialMean(alpha), ExponentialMean(alpha), ExponentialMean(alpha)]
+        self.previous = np.nan
+        self.column = column
+
+    def update(self, bar) -> OrderedDict:
+        value = self.price(bar)
+        for ema in self.chain:
+            value = ema.update(value)
+        previous, self.previous = self.previous, value
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = (value - previous) * 100 / previous
+        return OrderedDict([(self.column, result)])
+
+
+class AverageTrueRangeState(IndicatorState):
+
+    def __init__(self, window: int, column: str):
+        self.true_range = TrueRangeState()
+        self.smma = ExponentialMean(1.0 / window)
+        self.column = column
+
+    def update(self, bar) -> OrderedDict:
+        return OrderedDict([(self.column, self.smma.update(self.true_range.update(bar)))])
+
+
+class DirectionalIndexState(IndicatorState):
+
+    def __init__(self, window: int, smoothing: int, column: str):
+        self.true_range = TrueRangeState()
+        self.atr = ExponentialMean(1.0 / window)
+        self.pdm = ExponentialMean(2.0 / (window + 1.0))
+        self.mdm = ExponentialMean(2.0 / (window + 1.0))
+        self.adx = ExponentialMean(2.0 / (smoothing + 1.0))
+        self.previous_high = np.nan
+        self.previous_low = np.nan
+        self.column = column
+
+    def update(self, bar) -> OrderedDict:
+        high, low = self.price(bar, HeaderFactory.High), self.price(bar, HeaderFactory.Low)
+        up_move = high - self.previous_high
+        up_move = (up_move + abs(up_move)) / 2
+        down_move = self.previous_low - low
+        down_move = (down_move + abs(down_move)) / 2
+        self.previous_high, self.previous_low = high, low
+
+        atr = self.atr.update(self.true_range.update(bar))
+        pdm = self.pdm.update(up_move if up_move > down_move else 0.0)
+        mdm = self.mdm.update(down_move if down_move > up_move else 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            pdi = pdm / atr * 100
+            mdi = mdm / atr * 100
+            dx = abs(pdi - mdi) / (pdi + mdi) * 100
+        return OrderedDict([(self.column, self.adx.update(dx))])
+
+
+class BollingerState(IndicatorState):
+
+    def __init__(self, window: int, column: str):
+        self.prices = RollingBuffer(window)
+        self.column = column
+
+    def update(self, bar) -> OrderedDict:
+        price = self.price(bar)
+        self.prices.append(price)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = (price - self.prices.mean()) / (2 * self.prices.std())
+        return OrderedDict([(self.column, value)])
+
+
+class RsiState(IndicatorState):
+
+    def __init__(self, window: int, column: str):
+        self.gains = ExponentialMean(1.0 / window)
+        self.losses = ExponentialMean(1.0 / window)
+        self.previous = np.nan
+        self.column = column
+
+    def update(self, bar) -> OrderedDict:
+        price = self.price(bar)
+        change, self.previous = price - self.previous, price
+        gain = self.gains.update((change + abs(change)) / 2)
+        loss = self.losses.update((-change + abs(change)) / 2)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            value = (100 - 100 / (1.0 + gain / loss)) / 100
+        return OrderedDict([(self.column, value)])
+
+
+class MacdState(IndicatorState):
+
+    def __init__(self, n_fast: int, n_slow: int, signal_period: int):
+        self.fast = ExponentialMean(2.0 / (n_fast + 1.0), n_slow - 1)
+        self.slow = ExponentialMean(2.0 / (n_slow + 1.0), n_slow - 1)
+        self.signal = ExponentialMean(2.0 / (signal_period + 1.0), signal_period - 1)
+
+    def update(self, bar) -> OrderedDict:
+        price = self.price(bar)
+        macd = self.fast.update(price) - self.slow.update(price)
+        signal = self.signal.update(macd)
+        return OrderedDict([(HeaderFactory.MACD, macd),
+                            (HeaderFactory.MACD_SIGNAL, signal),
+                            (HeaderFactory.MACD_DIFF, macd - signal)])
+
+
+class BetaState(IndicatorState):
+    """Rolling beta and correlation of the bar returns against the benchmark returns.
+
+    The bars carry the benchmark's daily return under BENCHMARK, pairs with a missing return are
+    skipped like `RollingCorrelation.moments`.
+    """
+
+    BENCHMARK = 'BenchmarkReturn'
+
+    def __init__(self, window: int, beta_column: str, correlation_column: str):
+        self.window = window
+        self.returns = deque(maxlen=window)
+        self.previous = np.nan
+        self.columns = (beta_column, correlation_column)
+
+    def update(self, bar) -> OrderedDict:
+        price = self.price(bar)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            self.returns.append((price / self.previous - 1, self.price(bar, self.BENCHMARK)))
+        self.previous = price
+        returns = np.array(self.returns)
+        returns = returns[~np.isnan(returns).any(axis=1)]
+        beta = correlation = np.nan
+        if len(returns) >= max(self.window, 2):
+            covariance = np.cov(returns, rowvar=False)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                beta = covariance[0, 1] / covariance[1, 1]
+                correlation = covariance[0, 1] / np.sqrt(covariance[0, 0] * covariance[1, 1])
+        return OrderedDict(zip(self.columns, (beta, correlation)))
@@ -0,0 +1,71 @@
+import logging
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from PortfolioBasic.Definitions import HeaderFactory
+from PortfolioBasic.Technical.Rolling import RollingWindow
+
+logger = logging.getLogger(__name__)
+
+
+class FeatureTensor(object):
+    """Indicator values for a grid of windows, `values` is (features x windows x dates)."""
+
+    def __init__(self, values: np.ndarray, features, windows, index):
+        self.values = values
+        self.features = list(features)
+        self.windows = list(windows)
+        self.index = index
+
+    def frame(self, feature: str) -> pd.DataFrame:
+        """(dates x windows) frame of one feature."""
+        return pd.DataFrame(self.values[self.features.index(feature)].T, index=self.index, columns=self.windows)
+
+    def select(self, feature: str, window: int) -> pd.Series:
+        return pd.Series(self.values[self.features.index(feature), self.windows.index(window)], index=self.index,
+                         name='{}_{}'.format(feature, window))
+
+
+class WindowSweep(object):
+    """Window families of the moving average, Bollinger and Williams %R features in one pass.
+
+    Every window of a family comes out of the same cumulative sums (averages, deviations) or the
+    same sparse table (highs and lows), instead of one rolling pass per window. The values match
+    `rolling(window).mean()`, `BollingerIndicator` and the stockstats `wr_<window>` columns.
+    """
+
+    FEATURES = ('sma', HeaderFactory.Bollinger, 'wr')
+
+    def __init__(self, data: pd.DataFrame):
+        self.index = data.index
+        self.close = data[HeaderFactory.Price].values.astype(np.float64)
+        self.high = data[HeaderFactory.High].values.astype(np.float64) if HeaderFactory.High in data else None
+        self.low = data[HeaderFactory.Low].values.astype(np.float64) if HeaderFactory.Low in data else None
+
+    def sma(self, windows=range(5, 251)) -> np.ndarray:
+        return RollingWindow.means(self.close, windows)
+
+    def bollinger(self, windows=range(5, 251)) -> np.ndarray:
+        """(close - mean) / (2 * std) per window, as `BollingerIndicator`."""
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.close - RollingWindow.means(self.close, windows)) / (2 * RollingWindow.stds(self.close, windows))
+
+    def williams(self, windows=range(5, 251)) -> np.ndarray:
+        """Williams %R per window, as the stockstats `wr_<window>` column."""
+        if self.high is None or self.low is None:
+            raise ValueError("Williams %R needs {} and {} prices".format(HeaderFactory.High, HeaderFactory.Low))
+        high = RollingWindow.maxima(self.high, windows)
+        low = RollingWindow.minima(self.low, windows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (high - self.close) / (high - low) * 100
+
+    def calculate(self, windows=range(5, 251), features=FEATURES) -> FeatureTensor:
+        """All `features` over the same window grid."""
+        windows = list(windows)
+        calculators = OrderedDict([('sma', self.sma), (HeaderFactory.Bollinger, self.bollinger), ('wr', self.williams)])
+        values = np.empty((len(features), len(windows), len(self.index)))
+        for position, feature in enumerate(features):
+            values[position] = calculators[feature](windows)
+        return FeatureTensor(values, features, windows, self.index)
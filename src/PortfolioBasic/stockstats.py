@@ -26,6 +26,7 @@
 
 from __future__ import unicode_literals
 
+import functools
 import itertools
 import logging
 import operator
@@ -36,6 +37,9 @@ import numpy as np
 import pandas as pd
 from int_date import get_date_from_diff
 
+from PortfolioBasic.Technical.Filters import RecursiveFilter
+from PortfolioBasic.Technical.Rolling import RollingWindow
+
 __author__ = 'Cedric Zhuang'
 
 log = logging.getLogger(__name__)
@@ -90,9 +94,14 @@ class StockDataFrame(pd.DataFrame):
 
     @classmethod
     def to_ints(cls, shifts):
-        items = map(cls._process_shifts_segment,
+        return list(cls._parse_shifts(shifts))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def _parse_shifts(shifts):
+        items = map(StockDataFrame._process_shifts_segment,
                     shifts.split(','))
-        return sorted(list(set(itertools.chain(*items))))
+        return tuple(sorted(set(itertools.chain(*items))))
 
     @classmethod
     def to_int(cls, shifts):
@@ -137,6 +146,14 @@ class StockDataFrame(pd.DataFrame):
     @staticmethod
     def _set_nan_of_single_shift(pd_obj, shift, column_name):
         val = np.nan
+        scratch = getattr(pd_obj, '_scratch', None)
+        if scratch is not None and column_name in scratch:
+            values = scratch.get(column_name)
+            if shift > 0:
+                values[-shift:] = val
+            elif shift < 0:
+                values[:-shift] = val
+            return
         if shift > 0:
             pd_obj.loc[pd_obj.index[-shift:], column_name] = val
         elif shift < 0:
@@ -171,7 +188,7 @@ class StockDataFrame(pd.DataFrame):
 
     @classmethod
     def _get_log_ret(cls, df):
-        df['log-ret'] = np.log(df['close'] / df['close_-1_s'])
+        df['log-ret'] = np.log(df.raw('close') / df.raw('close_-1_s'))
 
     @classmethod
     def _get_c(cls, df, column, shifts):
@@ -185,8 +202,7 @@ class StockDataFrame(pd.DataFrame):
         """
         column_name = '{}_{}_{}'.format(column, shifts, 'c')
         shifts = abs(cls.to_int(shifts))
-        df[column_name] = df[column].rolling(
-            center=False, window=shifts).apply(np.count_nonzero)
+        df[column_name] = RollingWindow.count_nonzero(df.raw(column), shifts)
 
     @classmethod
     def _get_op(cls, df, column, threshold, op):
@@ -210,24 +226,29 @@ class StockDataFrame(pd.DataFrame):
     @classmethod
     def _init_shifted_columns(cls, column, df, shifts):
         # initialize the column if not
-        df.get(column)
+        df.raw(column)
         shifts = cls.to_ints(shifts)
         shift_column_names = ['{}_{}_s'.format(column, shift) for shift in
                               shifts]
-        [df.get(name) for name in shift_column_names]
+        [df.raw(name) for name in shift_column_names]
         return shift_column_names
 
     @classmethod
     def _get_max(cls, df, column, shifts):
         column_name = '{}_{}_max'.format(column, shifts)
         shift_column_names = cls._init_shifted_columns(column, df, shifts)
-        df[column_name] = np.max(df[shift_column_names], axis=1)
+        df[column_name] = cls._columns(df, shift_column_names).max(axis=1)
 
     @classmethod
     def _get_min(cls, df, column, shifts):
         column_name = '{}_{}_min'.format(column, shifts)
         shift_column_names = cls._init_shifted_columns(column, df, shifts)
-        df[column_name] = np.min(df[shift_column_names], axis=1)
+        df[column_name] = cls._columns(df, shift_column_names).min(axis=1)
+
+    @staticmethod
+    def _columns(df, names):
+        return pd.DataFrame(dict((name, df.raw(name)) for name in names),
+                            index=df.index, columns=names)
 
     @staticmethod
     def _get_rsv(df, n_days):
@@ -278,19 +299,20 @@ class StockDataFrame(pd.DataFrame):
         :return: None
         """
         n_days = int(n_days)
-        d = df['close_-1_d']
+        d = df.raw('close_-1_d')
 
-        df['closepm'] = (d + d.abs()) / 2
-        df['closenm'] = (-d + d.abs()) / 2
+        df['closepm'] = (d + np.abs(d)) / 2
+        df['closenm'] = (-d + np.abs(d)) / 2
         closepm_smma_column = 'closepm_{}_smma'.format(n_days)
         closenm_smma_column = 'closenm_{}_smma'.format(n_days)
-        p_ema = df[closepm_smma_column]
-        n_ema = df[closenm_smma_column]
+        p_ema = df.raw(closepm_smma_column)
+        n_ema = df.raw(closenm_smma_column)
 
         rs_column_name = 'rs_{}'.format(n_days)
         rsi_column_name = 'rsi_{}'.format(n_days)
-        df[rs_column_name] = rs = p_ema / n_ema
-        df[rsi_column_name] = 100 - 100 / (1.0 + rs)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df[rs_column_name] = rs = p_ema / n_ema
+            df[rsi_column_name] = 100 - 100 / (1.0 + rs)
 
         del df['closepm']
         del df['closenm']
@@ -307,9 +329,8 @@ class StockDataFrame(pd.DataFrame):
         """
         window = cls.get_only_one_positive_int(windows)
         column_name = '{}_{}_smma'.format(column, window)
-        smma = df[column].ewm(
-            ignore_na=False, alpha=1.0 / window,
-            min_periods=0, adjust=True).mean()
+        smma = pd.Series(RecursiveFilter.smma(df.raw(column), window),
+                         index=df.index)
         df[column_name] = smma
         return smma
 
@@ -329,15 +350,16 @@ class StockDataFrame(pd.DataFrame):
         single = '{c}_{w}_ema'.format(c=column, w=window)
         double = '{c}_{w}_ema_{w}_ema'.format(c=column, w=window)
         triple = '{c}_{w}_ema_{w}_ema_{w}_ema'.format(c=column, w=window)
-        df['ema3'] = df[triple]
-        prev_ema3 = df['ema3_-1_s']
-        df[column_name] = (df['ema3'] - prev_ema3) * 100 / prev_ema3
+        prev_triple = '{}_-1_s'.format(triple)
+        ema3 = df.raw(triple)
+        prev_ema3 = df.raw(prev_triple)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df[column_name] = (ema3 - prev_ema3) * 100 / prev_ema3
 
         del df[single]
         del df[double]
         del df[triple]
-        del df['ema3']
-        del df['ema3_-1_s']
+        del df[prev_triple]
 
     @classmethod
     def _get_wr(cls, df, n_days):
@@ -380,13 +402,12 @@ class StockDataFrame(pd.DataFrame):
             n_days = int(n_days)
             column_name = 'cci_{}'.format(n_days)
 
-        tp = df['middle']
-        tp_sma = df['middle_{}_sma'.format(n_days)]
-        md = df['middle'].rolling(
-            min_periods=1, center=False, window=n_days).apply(
-            lambda x: np.fabs(x - x.mean()).mean())
+        tp = df.raw('middle')
+        tp_sma = df.raw('middle_{}_sma'.format(n_days))
+        md = RollingWindow.mean_absolute_deviation(tp, n_days, min_periods=1)
 
-        df[column_name] = (tp - tp_sma) / (.015 * md)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df[column_name] = (tp - tp_sma) / (.015 * md)
 
     @classmethod
     def _get_tr(cls, df):
@@ -396,9 +417,9 @@ class StockDataFrame(pd.DataFrame):
         :param df: data
         :return: None
         """
-        prev_close = df['close_-1_s']
-        high = df['high']
-        low = df['low']
+        prev_close = df.raw('close_-1_s')
+        high = df.raw('high')
+        low = df.raw('low')
         c1 = high - low
         c2 = np.abs(high - prev_close)
         c3 = np.abs(low - prev_close)
@@ -423,7 +444,7 @@ class StockDataFrame(pd.DataFrame):
             column_name = 'atr_{}'.format(window)
         tr_smma_column = 'tr_{}_smma'.format(window)
 
-        df[column_name] = df[tr_smma_column]
+        df[column_name] = df.raw(tr_smma_column)
         del df[tr_smma_column]
 
     @classmethod
@@ -434,7 +455,7 @@ class StockDataFrame(pd.DataFrame):
         :param df: data
         :return: None
         """
-        df['dma'] = df['close_10_sma'] - df['close_50_sma']
+        df['dma'] = df.raw('close_10_sma') - df.raw('close_50_sma')
 
     @classmethod
     def _get_dmi(cls, df):
@@ -451,8 +472,8 @@ class StockDataFrame(pd.DataFrame):
         df['pdi'] = cls._get_pdi(df, 14)
         df['mdi'] = cls._get_mdi(df, 14)
         df['dx'] = cls._get_dx(df, 14)
-        df['adx'] = df['dx_6_ema']
-        df['adxr'] = df['adx_6_ema']
+        df['adx'] = df.raw('dx_6_ema')
+        df['adxr'] = df.raw('adx_6_ema')
 
     @classmethod
     def _get_um_dm(cls, df):
@@ -461,10 +482,10 @@ class StockDataFrame(pd.DataFrame):
         initialize up move and down move
         :param df: data
         """
-        hd = df['high_delta']
-        df['um'] = (hd + hd.abs()) / 2
-        ld = -df['low_delta']
-        df['dm'] = (ld + ld.abs()) / 2
+        hd = df.raw('high_delta')
+        df['um'] = (hd + np.abs(hd)) / 2
+        ld = -df.raw('low_delta')
+        df['dm'] = (ld + np.abs(ld)) / 2
 
     @classmethod
     def _get_pdm(cls, df, windows):
@@ -477,12 +498,13 @@ class StockDataFrame(pd.DataFrame):
         """
         window = cls.get_only_one_positive_int(windows)
         column_name = 'pdm_{}'.format(window)
-        um, dm = df['um'], df['dm']
-        df['pdm'] = np.where(um > dm, um, 0)
+        um, dm = df.raw('um'), df.raw('dm')
+        with np.errstate(invalid='ignore'):
+            df['pdm'] = np.where(um > dm, um, 0)
         if window > 1:
-            pdm = df['pdm_{}_ema'.format(window)]
+            pdm = df.raw('pdm_{}_ema'.format(window))
         else:
-            pdm = df['pdm']
+            pdm = df.raw('pdm')
         df[column_name] = pdm
 
     @classmethod
@@ -522,12 +544,13 @@ class StockDataFrame(pd.DataFrame):
         """
         window = cls.get_only_one_positive_int(windows)
         column_name = 'mdm_{}'.format(window)
-        um, dm = df['um'], df['dm']
-        df['mdm'] = np.where(dm > um, dm, 0)
+        um, dm = df.raw('um'), df.raw('dm')
+        with np.errstate(invalid='ignore'):
+            df['mdm'] = np.where(dm > um, dm, 0)
         if window > 1:
-            mdm = df['mdm_{}_ema'.format(window)]
+            mdm = df.raw('mdm_{}_ema'.format(window))
         else:
-            mdm = df['mdm']
+            mdm = df.raw('mdm')
         df[column_name] = mdm
 
     @classmethod
@@ -542,8 +565,9 @@ class StockDataFrame(pd.DataFrame):
         pdm_column = 'pdm_{}'.format(window)
         tr_column = 'atr_{}'.format(window)
         pdi_column = 'pdi_{}'.format(window)
-        df[pdi_column] = df[pdm_column] / df[tr_column] * 100
-        return df[pdi_column]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df[pdi_column] = df.raw(pdm_column) / df.raw(tr_column) * 100
+        return df.raw(pdi_column)
 
     @classmethod
     def _get_mdi(cls, df, windows):
@@ -551,8 +575,9 @@ class StockDataFrame(pd.DataFrame):
         mdm_column = 'mdm_{}'.format(window)
         tr_column = 'atr_{}'.format(window)
         mdi_column = 'mdi_{}'.format(window)
-        df[mdi_column] = df[mdm_column] / df[tr_column] * 100
-        return df[mdi_column]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df[mdi_column] = df.raw(mdm_column) / df.raw(tr_column) * 100
+        return df.raw(mdi_column)
 
     @classmethod
     def _get_dx(cls, df, windows):
@@ -560,9 +585,10 @@ class StockDataFrame(pd.DataFrame):
         dx_column = 'dx_{}'.format(window)
         mdi_column = 'mdi_{}'.format(window)
         pdi_column = 'pdi_{}'.format(window)
-        mdi, pdi = df[mdi_column], df[pdi_column]
-        df[dx_column] = abs(pdi - mdi) / (pdi + mdi) * 100
-        return df[dx_column]
+        mdi, pdi = df.raw(mdi_column), df.raw(pdi_column)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            df[dx_column] = abs(pdi - mdi) / (pdi + mdi) * 100
+        return df.raw(dx_column)
 
     @classmethod
     def _get_kdj_default(cls, df):
@@ -571,19 +597,20 @@ class StockDataFrame(pd.DataFrame):
         :param df: k line data frame
         :return: None
         """
-        df['kdjk'] = df['kdjk_9']
-        df['kdjd'] = df['kdjd_9']
-        df['kdjj'] = df['kdjj_9']
+        df['kdjk'] = df.raw('kdjk_9')
+        df['kdjd'] = df.raw('kdjd_9')
+        df['kdjj'] = df.raw('kdjj_9')
 
     @classmethod
     def _get_cr(cls, df, window=26):
-        ym = df['middle_-1_s']
-        h = df['high']
-        p1_m = df.loc[:, ['middle_-1_s', 'high']].min(axis=1)
-        p2_m = df.loc[:, ['middle_-1_s', 'low']].min(axis=1)
-        p1 = (h - p1_m).rolling(
+        ym = df.raw('middle_-1_s')
+        h = df.raw('high')
+        # fmin skips NaN like DataFrame.min
+        p1_m = np.fmin(ym, h)
+        p2_m = np.fmin(ym, df.raw('low'))
+        p1 = pd.Series(h - p1_m, index=df.index).rolling(
             min_periods=1, window=window, center=False).sum()
-        p2 = (ym - p2_m).rolling(
+        p2 = pd.Series(ym - p2_m, index=df.index).rolling(
             min_periods=1, window=window, center=False).sum()
         df['cr'] = p1 / p2 * 100
         del df['middle_-1_s']
@@ -607,16 +634,12 @@ class StockDataFrame(pd.DataFrame):
 
     @classmethod
     def _get_middle(cls, df):
-        df['middle'] = (df['close'] + df['high'] + df['low']) / 3.0
+        df['middle'] = (df.raw('close') + df.raw('high') + df.raw('low')) / 3.0
 
     @classmethod
     def _calc_kd(cls, column):
         param0, param1 = cls.KDJ_PARAM
-        k = 50.0
-        # noinspection PyTypeChecker
-        for i in param1 * column:
-            k = param0 * k + i
-            yield k
+        return RecursiveFilter.first_order(column, param0, param1, 50.0)
 
     @classmethod
     def _get_kdjk(cls, df, n_days):
@@ -630,7 +653,7 @@ class StockDataFrame(pd.DataFrame):
         """
         rsv_column = 'rsv_{}'.format(n_days)
         k_column = 'kdjk_{}'.format(n_days)
-        df[k_column] = list(cls._calc_kd(df.get(rsv_column)))
+        df[k_column] = cls._calc_kd(df.raw(rsv_column))
 
     @classmethod
     def _get_kdjd(cls, df, n_days):
@@ -644,7 +667,7 @@ class StockDataFrame(pd.DataFrame):
         """
         k_column = 'kdjk_{}'.format(n_days)
         d_column = 'kdjd_{}'.format(n_days)
-        df[d_column] = list(cls._calc_kd(df.get(k_column)))
+        df[d_column] = cls._calc_kd(df.raw(k_column))
 
     @staticmethod
     def _get_kdjj(df, n_days):
@@ -658,7 +681,7 @@ class StockDataFrame(pd.DataFrame):
         k_column = 'kdjk_{}'.format(n_days)
         d_column = 'kdjd_{}'.format(n_days)
         j_column = 'kdjj_{}'.format(n_days)
-        df[j_column] = 3 * df[k_column] - 2 * df[d_column]
+        df[j_column] = 3 * df.raw(k_column) - 2 * df.raw(d_column)
 
     @staticmethod
     def remove_random_nan(pd_obj):
@@ -669,7 +692,7 @@ class StockDataFrame(pd.DataFrame):
         shift = StockDataFrame.to_int(shifts)
         shift_column = '{}_{}_s'.format(column, shift)
         column_name = '{}_{}_d'.format(column, shift)
-        df[column_name] = df[column] - df[shift_column]
+        df[column_name] = df.raw(column) - df.raw(shift_column)
         StockDataFrame.set_nan(df, shift, column_name)
 
     @classmethod
@@ -698,9 +721,7 @@ class StockDataFrame(pd.DataFrame):
         window = cls.get_only_one_positive_int(windows)
         column_name = '{}_{}_ema'.format(column, window)
         if len(df[column]) > 0:
-            df[column_name] = df[column].ewm(
-                ignore_na=False, span=window,
-                min_periods=0, adjust=True).mean()
+            df[column_name] = RecursiveFilter.ema(df.raw(column), window)
         else:
             df[column_name] = []
 
@@ -717,18 +738,12 @@ class StockDataFrame(pd.DataFrame):
         :param df: data
         :return: None
         """
-        moving_avg = df['close_{}_sma'.format(cls.BOLL_PERIOD)]
-        moving_std = df['close_{}_mstd'.format(cls.BOLL_PERIOD)]
-        df['boll'] = moving_avg
-        moving_avg = list(map(np.float64, moving_avg))
-        moving_std = list(map(np.float64, moving_std))
-        # noinspection PyTypeChecker
-        df['boll_ub'] = np.add(moving_avg,
-                               np.multiply(cls.BOLL_STD_TIMES, moving_std))
-        # noinspection PyTypeChecker
-        df['boll_lb'] = np.subtract(moving_avg,
-                                    np.multiply(cls.BOLL_STD_TIMES,
-                                                moving_std))
+        # same min_periods=1 windows as close_20_sma and close_20_mstd
+        bands = RollingWindow.bollinger(df.raw('close'), cls.BOLL_PERIOD,
+                                        cls.BOLL_STD_TIMES, min_periods=1)
+        df['boll'] = bands['mean']
+        df['boll_ub'] = bands['upper']
+        df['boll_lb'] = bands['lower']
 
     @staticmethod
     def _get_macd(df):
@@ -742,10 +757,10 @@ class StockDataFrame(pd.DataFrame):
         :param df: data
         :return: None
         """
-        fast = df['close_12_ema']
-        slow = df['close_26_ema']
+        fast = df.raw('close_12_ema')
+        slow = df.raw('close_26_ema')
         df['macd'] = fast - slow
-        df['macds'] = df['macd_9_ema']
+        df['macds'] = df.raw('macd_9_ema')
         df['macdh'] = 2 * (df['macd'] - df['macds'])
         del df['macd_9_ema']
         del fast
@@ -789,12 +804,21 @@ class StockDataFrame(pd.DataFrame):
         df[column_name] = df[column].rolling(
             min_periods=1, window=window, center=False).var()
 
+    COLUMN_MATCH = re.compile(r'(.*)_([\d\-\+~,\.]+)_(\w+)')
+    SHORT_COLUMN_MATCH = re.compile(r'(.*)_([\d\-\+~,]+)')
+
     @staticmethod
+    @functools.lru_cache(maxsize=1024)
     def parse_column_name(name):
-        m = re.match('(.*)_([\d\-\+~,\.]+)_(\w+)', name)
-        ret = [None, None, None]
+        """ split a column key into (column, window or shifts, type)
+
+        The same keys are parsed over and over while indicators build their
+        intermediates, so the results are cached.
+        """
+        m = StockDataFrame.COLUMN_MATCH.match(name)
+        ret = (None, None, None)
         if m is None:
-            m = re.match('(.*)_([\d\-\+~,]+)', name)
+            m = StockDataFrame.SHORT_COLUMN_MATCH.match(name)
             if m is not None:
                 ret = m.group(1, 2)
                 ret = ret + (None,)
@@ -803,15 +827,17 @@ class StockDataFrame(pd.DataFrame):
         return ret
 
     CROSS_COLUMN_MATCH_STR = '(.+)_(x|xu|xd)_(.+)'
+    CROSS_COLUMN_MATCH = re.compile(CROSS_COLUMN_MATCH_STR)
 
     @classmethod
     def is_cross_columns(cls, name):
-        return re.match(cls.CROSS_COLUMN_MATCH_STR, name) is not None
+        return cls.parse_cross_column(name)[0] is not None
 
-    @classmethod
-    def parse_cross_column(cls, name):
-        m = re.match(cls.CROSS_COLUMN_MATCH_STR, name)
-        ret = [None, None, None]
+    @staticmethod
+    @functools.lru_cache(maxsize=1024)
+    def parse_cross_column(name):
+        m = StockDataFrame.CROSS_COLUMN_MATCH.match(name)
+        ret = (None, None, None)
         if m is not None:
             ret = m.group(1, 2, 3)
         return ret
@@ -914,9 +940,73 @@ class StockDataFrame(pd.DataFrame):
             if len(df) == 0:
                 df[key] = []
             else:
-                StockDataFrame.__init_not_exist_column(df, key)
+                hooks = [hook for hook in (getattr(df, '_graph', None),
+                                           getattr(df, '_scratch', None))
+                         if hook is not None]
+                if not hooks:
+                    StockDataFrame.__init_not_exist_column(df, key)
+                    return
+                for hook in hooks:
+                    hook.enter(key)
+                try:
+                    StockDataFrame.__init_not_exist_column(df, key)
+                finally:
+                    for hook in reversed(hooks):
+                        hook.leave(key)
+
+    # dependency recorder, see PortfolioBasic.Technical.Planner.ColumnGraph
+    _graph = None
+    # store of the intermediates, see PortfolioBasic.Technical.Planner.ScratchStore
+    _scratch = None
+
+    def track(self, graph):
+        """ record column dependencies into `graph` and keep deleted intermediates
+
+        :param graph: recorder, or None to stop tracking
+        :return: None
+        """
+        object.__setattr__(self, '_graph', graph)
+
+    def scratch(self, store):
+        """ keep intermediate columns in `store` instead of the frame
+
+        Only the columns the store does not hold, the requested outputs, are
+        inserted into the frame.
+        :param store: intermediate store, or None to write to the frame again
+        :return: None
+        """
+        object.__setattr__(self, '_scratch', store)
+
+    def __contains__(self, key):
+        if self._scratch is not None and isinstance(key, str) \
+                and key in self._scratch:
+            return True
+        return super(StockDataFrame, self).__contains__(key)
+
+    def __setitem__(self, key, value):
+        if self._scratch is not None and isinstance(key, str) \
+                and self._scratch.holds(key):
+            self._scratch.put(key, value)
+        else:
+            super(StockDataFrame, self).__setitem__(key, value)
+
+    def __delitem__(self, key):
+        if self._graph is not None:
+            self._graph.retain(key)
+        elif self._scratch is not None:
+            self._scratch.delete(key)
+        else:
+            super(StockDataFrame, self).__delitem__(key)
 
     def __getitem__(self, item):
+        if self._graph is not None:
+            self._graph.use(item)
+        if self._scratch is not None and isinstance(item, str):
+            if item not in self:
+                self.init_columns(self, item)
+            if item in self._scratch:
+                return pd.Series(self._scratch.get(item), index=self.index,
+                                 name=item)
         try:
             result = self.retype(
                 super(StockDataFrame, self).__getitem__(item))
@@ -929,6 +1019,25 @@ class StockDataFrame(pd.DataFrame):
                 super(StockDataFrame, self).__getitem__(item))
         return result
 
+    def raw(self, key):
+        """ values of a column as a numpy array, initialized if missing
+
+        Unlike `self[key]` the result is not retyped into a new frame, which
+        is all the indicator calculations need from their intermediates.
+        :param key: column name
+        :return: numpy array
+        """
+        if self._graph is not None:
+            self._graph.use(key)
+        if key not in self:
+            try:
+                self.init_columns(self, key)
+            except AttributeError:
+                log.exception('{} not found.'.format(key))
+        if self._scratch is not None and key in self._scratch:
+            return self._scratch.get(key)
+        return pd.DataFrame.__getitem__(self, key).values
+
     def in_date_delta(self, delta_day, anchor=None):
         if anchor is None:
             anchor = self.get_today()
@@ -0,0 +1,128 @@
+import io
+import threading
+from os import path
+
+import numpy as np
+import pandas as pd
+
+from utilities import logger
+
+
+class DailySentiment(object):
+    """Daily mean article sentiment, kept as running per-day sums and counts.
+
+    `update` reads the results file in bounded blocks and remembers how far it got, so
+    articles appended to the file later are aggregated without reading it again.
+    """
+
+    EMOTIONS = ['Anger', 'Anticipation', 'Disgust', 'Fear', 'Joy', 'Sadness', 'Surprise', 'Trust']
+    DATE_FORMAT = '%d/%m/%Y %H:%M:%S'
+
+    def __init__(self, location: str, full_articles=True, block_bytes=16 * 1024 * 1024):
+        self.location = location
+        self.full_articles = full_articles
+        self.block_bytes = block_bytes
+        self.columns = ['Calculated'] + (self.EMOTIONS if full_articles else [])
+        self.header = None
+        self.offset = 0
+        self.sums = None
+        self.counts = None
+        # (sums, counts) of a last line without a newline, not part of the totals
+        self.pending = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        self.header = None
+        self.offset = 0
+        self.sums = None
+        self.counts = None
+        self.pending = None
+
+    def update(self) -> int:
+        """Aggregate the articles added to the file since the last call, returns their number.
+
+        A last line without a newline counts as complete, but is read again by the next call in
+        case it was still being written.
+        """
+        with self._lock:
+            if path.getsize(self.location) < self.offset:
+                logger.info("[%s] was truncated, aggregating it again", self.location)
+                self.reset()
+            self.pending = None
+            total = 0
+            with open(self.location, 'rb') as stream:
+                if self.header is None:
+                    line = stream.readline()
+                    self.header = line.decode('utf-8-sig').strip().split(',')
+                    self.offset = len(line)
+                stream.seek(self.offset)
+                while True:
+                    block = stream.read(self.block_bytes)
+                    if not block:
+                        break
+                    # only complete lines are consumed, the offset stays before an unterminated last line
+                    end = block.rfind(b'\n') + 1
+                    if end == 0:
+                        if len(block) < self.block_bytes:
+                            self.pending = self.aggregate_tail(block)
+                            break
+                        self.block_bytes *= 2
+                        stream.seek(self.offset)
+                        continue
+                    total += self.add(self.parse(block[:end]))
+                    self.offset += end
+                    stream.seek(self.offset)
+            return total
+
+    def parse(self, lines: bytes) -> pd.DataFrame:
+        return pd.read_csv(io.BytesIO(lines), header=None, names=self.header, na_values=["nan"])
+
+    def aggregate_tail(self, line: bytes):
+        """(sums, counts) of the unterminated last line, None if it is empty or still incomplete."""
+        if not line.strip():
+            return None
+        try:
+            return self.aggregate(self.parse(line))
+        except (ValueError, KeyError):
+            logger.debug("[%s] ends in an incomplete line", self.location)
+            return None
+
+    def add(self, articles: pd.DataFrame) -> int:
+        """Add raw article rows to the daily sums and counts."""
+        if len(articles) == 0:
+            return 0
+        sums, counts = self.aggregate(articles)
+        if self.sums is None:
+            self.sums, self.counts = sums, counts
+        else:
+            self.sums = self.sums.add(sums, fill_value=0)
+            self.counts = self.counts.add(counts, fill_value=0)
+        return len(articles)
+
+    def aggregate(self, articles: pd.DataFrame):
+        """Per-day (sums, counts) of raw article rows."""
+        values = pd.DataFrame(index=pd.to_datetime(articles['Date'], format=self.DATE_FORMAT).dt.floor('D').values)
+        values['Calculated'] = ((articles['Calculated'].values - 1) / 2) - 1
+        if self.full_articles:
+            for emotion in self.EMOTIONS:
+                values[emotion] = articles[emotion].values / articles['TotalWords'].values
+
+        grouped = values.groupby(level=0)
+        return grouped.sum(), grouped.count()
+
+    def means(self) -> pd.DataFrame:
+        """Mean per calendar day, days without articles are NaN."""
+        with self._lock:
+            sums, counts = self.sums, self.counts
+            if self.pending is not None:
+                if sums is None:
+                    sums, counts = self.pending
+                else:
+                    sums = sums.add(self.pending[0], fill_value=0)
+                    counts = counts.add(self.pending[1], fill_value=0)
+        if sums is None:
+            return pd.DataFrame(columns=self.columns, index=pd.DatetimeIndex([], name='Date', freq='D'))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result = sums / counts.where(counts > 0)
+        days = pd.date_range(result.index.min(), result.index.max(), freq='D', name='Date')
+        return result.reindex(days)[self.columns]
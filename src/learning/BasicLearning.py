@@ -4,6 +4,7 @@ import sklearn
 from sklearn.calibration import CalibratedClassifierCV
 from sklearn import svm
 
+from PortfolioBasic.Instrumentation import tracer
 from utilities.Utilities import Utilities
 from learning import logger
 
@@ -22,7 +23,8 @@ class BaseClassifier(object):
         self.grid_search(x, y)
         self.clf = self.construct_classifier()
         logger.info("Training...")
-        return self.clf.fit(x, y)
+        with tracer.span('fit', classifier=type(self).__name__, rows=len(x)):
+            return self.clf.fit(x, y)
 
     def predict_proba(self, x):
         return self.clf.predict_proba(x)
@@ -36,7 +38,8 @@ class BaseClassifier(object):
             return
 
         logger.info("Searching classifier best parameters")
-        self.clf_best = self.perform_grid_search(x, y)
+        with tracer.span('grid_search', classifier=type(self).__name__, rows=len(x)):
+            self.clf_best = self.perform_grid_search(x, y)
 
     @abc.abstractmethod
     def perform_grid_search(self, x, y):
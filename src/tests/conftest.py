@@ -0,0 +1,38 @@
+import sys
+from os import path
+
+import numpy as np
+import pandas as pd
+import pytest
+
+# the modules import each other from the src directory
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+
+def make_prices(days: int = 300, seed: int = 0, start: str = '2011-01-03') -> pd.DataFrame:
+    """Random walk Open/High/Low/Close/Volume bars on business days."""
+    random = np.random.RandomState(seed)
+    close = 50 * np.exp(np.cumsum(random.normal(0, 0.01, days)))
+    spread = np.abs(random.normal(0, 0.5, days))
+    return pd.DataFrame({'Open': close + random.normal(0, 0.2, days),
+                         'High': close + spread,
+                         'Low': close - spread,
+                         'Close': close,
+                         'Volume': random.randint(1000, 5000, days).astype(np.float64)},
+                        index=pd.bdate_range(start, periods=days, name='Date'))
+
+
+class FrameSource(object):
+    """Market data source serving in-memory frames by ticker."""
+
+    def __init__(self, frames: dict):
+        self.frames = frames
+
+    def get_stock_data(self, stock_name, from_date=None, to_date=None):
+        frame = self.frames[stock_name]
+        return frame.loc[from_date:to_date].copy()
+
+
+@pytest.fixture
+def prices():
+    return make_prices()
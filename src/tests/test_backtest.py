@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from PortfolioBasic.Backtest import Backtest
+
+PARAMETERS = [
+    # buy, sell, stop_low, stop_high, cost
+    (0.5, 0.5, np.nan, np.nan, 0.0),
+    (0.6, 0.4, 0.02, 0.05, 0.001),
+    (0.7, 0.3, 0.01, np.nan, 0.0005),
+    (0.55, 0.45, np.nan, 0.03, 0.002),
+]
+
+
+@pytest.fixture
+def market():
+    random = np.random.RandomState(1)
+    index = pd.bdate_range('2012-01-02', periods=400)
+    prices = pd.DataFrame(100 * np.exp(np.cumsum(random.normal(0, 0.01, (400, 4)), axis=0)), index=index,
+                          columns=list('ABCD'))
+    # C is listed later
+    prices.iloc[:50, 2] = np.nan
+    # runs of the same signal, so trades last long enough to reach their stops
+    signals = pd.DataFrame(np.repeat(random.random_sample((40, 4)), 10, axis=0), index=index, columns=prices.columns)
+    return prices, signals
+
+
+def reference(prices, signals, buy, sell, stop_low, stop_high, cost, allow_short=True):
+    """Day by day (positions, returns) of the rules described by Backtest."""
+    prices, signals = prices.values, signals.values
+    positions = np.zeros(prices.shape)
+    returns = np.zeros(prices.shape)
+    for ticker in range(prices.shape[1]):
+        desired_before, entry, stopped, held = None, np.nan, False, 0.0
+        for day in range(prices.shape[0]):
+            signal, price = signals[day, ticker], prices[day, ticker]
+            if np.isnan(signal) or np.isnan(price):
+                desired = 0.0
+            elif signal >= buy:
+                desired = 1.0
+            elif signal <= sell:
+                desired = -1.0 if allow_short else 0.0
+            else:
+                desired = 0.0
+            if desired != desired_before:
+                entry, stopped, desired_before = price, False, desired
+            if desired != 0 and not stopped:
+                gain = desired * (price / entry - 1)
+                if gain <= -stop_low or gain >= stop_high:
+                    stopped = True
+            position = 0.0 if stopped else desired
+            result = -cost * abs(position - held)
+            if day > 0 and not np.isnan(prices[day - 1, ticker]) and not np.isnan(price):
+                result += held * (price / prices[day - 1, ticker] - 1)
+            positions[day, ticker], returns[day, ticker], held = position, result, position
+    return positions, returns
+
+
+@pytest.mark.parametrize('allow_short', [True, False])
+@pytest.mark.parametrize('parameters', PARAMETERS)
+def test_run_matches_reference_loop(market, parameters, allow_short):
+    prices, signals = market
+    result = Backtest(prices, signals, allow_short=allow_short).run(*parameters)
+    positions, returns = reference(prices, signals, *parameters, allow_short=allow_short)
+
+    np.testing.assert_array_equal(result.positions.values, positions)
+    np.testing.assert_allclose(result.returns.values, returns, rtol=1e-12, atol=1e-15)
+    np.testing.assert_allclose(result.portfolio.values, returns.mean(axis=1), rtol=1e-12, atol=1e-15)
+    if not allow_short:
+        assert (positions >= 0).all()
+    statistics = result.statistics()
+    assert statistics['total_return'] == pytest.approx(np.prod(1 + returns.mean(axis=1)) - 1, rel=1e-12)
+
+
+def test_parameters_change_the_trades(market):
+    # the cases above exercise stops, costs and disabled shorts, not just the plain signal
+    prices, signals = market
+    plain_positions, plain_returns = reference(prices, signals, 0.6, 0.4, np.nan, np.nan, 0.0)
+    stopped_positions, _ = reference(prices, signals, 0.6, 0.4, 0.02, 0.05, 0.0)
+    _, costly_returns = reference(prices, signals, 0.6, 0.4, np.nan, np.nan, 0.001)
+    long_positions, _ = reference(prices, signals, 0.6, 0.4, np.nan, np.nan, 0.0, allow_short=False)
+    assert (stopped_positions != plain_positions).any()
+    assert (costly_returns < plain_returns).any()
+    assert (plain_positions < 0).any() and (long_positions != plain_positions).any()
+
+
+def test_sweep_matches_run_statistics(market):
+    prices, signals = market
+    backtest = Backtest(prices, signals)
+    sweep = backtest.sweep(buy=(0.5, 0.6, 0.7), sell=(0.3, 0.5), stop_low=(np.nan, 0.02), stop_high=(np.nan, 0.05),
+                           cost=(0.0, 0.001), chunk_size=5)
+    assert len(sweep) == 3 * 2 * 2 * 2 * 2
+    for _, row in sweep.iterrows():
+        statistics = backtest.run(row['buy'], row['sell'], row['StopLow'], row['StopHigh'], row['cost']).statistics()
+        np.testing.assert_allclose(row[statistics.index].values.astype(np.float64),
+                                   statistics.values.astype(np.float64), rtol=1e-10, equal_nan=True)
@@ -0,0 +1,26 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from PortfolioBasic.Technical.Cache import IndicatorCache
+
+
+def test_round_trip_keeps_timezone(tmp_path):
+    cache = IndicatorCache(str(tmp_path))
+    frame = pd.DataFrame({'a': np.arange(5.0)}, index=pd.date_range('2020-01-01', periods=5, tz='UTC', name='Date'))
+    cache.put('key', frame)
+    pd.testing.assert_frame_equal(cache.get('key'), frame, check_freq=False)
+
+
+def test_hit_survives_eviction_after_read(tmp_path, monkeypatch):
+    cache = IndicatorCache(str(tmp_path))
+    frame = pd.DataFrame({'a': np.arange(5.0)}, index=pd.date_range('2020-01-01', periods=5))
+    cache.put('key', frame)
+
+    def evicted(file_name, times):
+        raise FileNotFoundError(file_name)
+
+    monkeypatch.setattr(os, 'utime', evicted)
+    pd.testing.assert_frame_equal(cache.get('key'), frame, check_freq=False)
+    assert cache.hits == 1
@@ -0,0 +1,33 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from PortfolioBasic.Technical.Filters import RecursiveFilter
+from PortfolioBasic.Technical.Streaming import ExponentialMean
+
+VALUES = [np.inf, 1, np.inf, 2, np.nan, 3, -np.inf, 4, 5, np.nan, np.nan, 6]
+
+
+def expected(values, alpha, min_periods):
+    return pd.Series(values).ewm(alpha=alpha, adjust=True, ignore_na=False, min_periods=min_periods).mean().values
+
+
+@pytest.mark.parametrize('alpha', [0.1, 0.5, 1.0])
+@pytest.mark.parametrize('min_periods', [0, 3])
+def test_ewm_mean_skips_nan_and_inf_like_pandas(alpha, min_periods):
+    result = RecursiveFilter.ewm_mean(VALUES, alpha, min_periods)
+    np.testing.assert_allclose(result, expected(VALUES, alpha, min_periods), rtol=1e-12)
+
+
+def test_ewm_mean_filters_columns_independently():
+    values = np.column_stack([VALUES, VALUES[::-1]])
+    result = RecursiveFilter.ewm_mean(values, 0.3)
+    np.testing.assert_allclose(result[:, 0], expected(VALUES, 0.3, 0), rtol=1e-12)
+    np.testing.assert_allclose(result[:, 1], expected(VALUES[::-1], 0.3, 0), rtol=1e-12)
+
+
+@pytest.mark.parametrize('min_periods', [0, 3])
+def test_exponential_mean_skips_nan_and_inf_like_pandas(min_periods):
+    state = ExponentialMean(0.3, min_periods)
+    result = [state.update(value) for value in VALUES]
+    np.testing.assert_allclose(result, expected(VALUES, 0.3, min_periods), rtol=1e-12)
@@ -0,0 +1,48 @@
+import threading
+
+import numpy as np
+import pytest
+
+from DataLoader import DataLoader
+from conftest import FrameSource, make_prices
+
+TICKERS = ['A', 'B', 'C', 'D', 'E', 'F']
+
+
+@pytest.fixture
+def source():
+    return FrameSource({ticker: make_prices(500, seed=seed) for seed, ticker in enumerate(TICKERS)})
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_results_equal_load_data(source, processes):
+    loader = DataLoader()
+    options = dict(source=source, from_date='2011-06-01', to_date='2012-06-01', horizons=[1, 5])
+    results = {ticker: (x_data, y_data) for ticker, x_data, y_data in
+               loader.load_many(TICKERS[:3], 5, workers=2, processes=processes, **options)}
+
+    assert sorted(results) == TICKERS[:3]
+    for ticker, (x_data, y_data) in results.items():
+        expected_x, expected_y = loader.load_data(ticker, 5, **options)
+        np.testing.assert_array_equal(x_data, expected_x)
+        np.testing.assert_array_equal(y_data, expected_y)
+
+
+def test_in_flight_results_are_capped():
+    loader = DataLoader()
+    lock = threading.Lock()
+    alive = [0, 0]
+
+    def load_data(ticker, days, **options):
+        with lock:
+            alive[0] += 1
+            alive[1] = max(alive)
+        return np.zeros(1), np.zeros(1)
+
+    loader.load_data = load_data
+    for ticker, x_data, y_data in loader.load_many(TICKERS, 5, workers=4, max_in_flight=2):
+        # the consumer still holds this result while it works
+        threading.Event().wait(0.01)
+        with lock:
+            alive[0] -= 1
+    assert alive[1] <= 2
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+
+from DataLoader import DataLoader
+from conftest import FrameSource, make_prices
+
+
+def write_articles(file_name, articles):
+    """Results file of the sentiment scorer with one article per (date, score)."""
+    with open(file_name, 'w') as stream:
+        stream.write('Id,Date,Original,Calculated,TotalSentimentWords,Anger,Anticipation,Disgust,Fear,Joy,Sadness,'
+                     'Surprise,Trust,TotalWords\n')
+        for number, (date, score) in enumerate(articles):
+            stream.write('{},{},5,{},10,1,1,1,1,1,1,1,1,100\n'.format(
+                number, pd.Timestamp(date).strftime('%d/%m/%Y %H:%M:%S'), score))
+
+
+def test_load_joins_articles_onto_trading_days(tmp_path):
+    location = str(tmp_path / 'articles.csv')
+    # 2011-06-04 is a Saturday
+    write_articles(location, [('2011-06-03 10:00', 5), ('2011-06-04 10:00', 3)])
+    source = FrameSource({'TEST': make_prices(400)})
+
+    x_data, y_data = DataLoader().load('TEST', days=1, source=source, sentiment_location=location,
+                                       full_articles=False, from_date='2011-05-02', to_date='2011-07-29')
+
+    trading_days = pd.bdate_range('2011-05-02', '2011-07-29')
+    assert x_data.shape[0] == len(trading_days) - 2
+    assert len(y_data) == len(trading_days) - 2
+    # the first row is dropped, the Friday article is on its own trading day
+    friday = trading_days.get_loc(pd.Timestamp('2011-06-03')) - 1
+    calculated = x_data[:, 0]
+    assert calculated[friday] == (5 - 1) / 2.0 - 1
+    assert np.count_nonzero(calculated) == 1
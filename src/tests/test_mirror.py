@@ -0,0 +1,61 @@
+import pandas as pd
+import pytest
+
+from MarketMirror import QuandlMirror
+from conftest import make_prices
+
+
+class StubEndpoint(object):
+    """Serves WIKI/PRICES rows of in-memory prices and records the requested ranges."""
+
+    def __init__(self, prices: pd.DataFrame):
+        self.prices = prices
+        self.calls = []
+
+    def fetch(self, ticker, from_date=None, to_date=None):
+        self.calls.append((from_date, to_date))
+        prices = self.prices.loc[from_date:to_date]
+        rows = pd.DataFrame({'ticker': ticker, 'date': prices.index, 'ex-dividend': 0.0, 'split_ratio': 1.0})
+        for column in ['Open', 'High', 'Low', 'Close', 'Volume']:
+            rows[column.lower()] = prices[column].values
+            rows['adj_' + column.lower()] = prices[column].values
+        return rows
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    # daily bars up to and including today
+    prices = make_prices(300)
+    prices.index = pd.date_range(end=pd.Timestamp.today().normalize(), periods=300, name='Date')
+    return QuandlMirror(str(tmp_path), StubEndpoint(prices))
+
+
+def test_top_up_fetches_only_missing_dates(mirror):
+    prices = mirror.endpoint.prices
+    first, middle, last = prices.index[10], prices.index[100], prices.index[200]
+
+    stored = mirror.get_stock_data('TEST', first, middle)
+    assert stored.index.equals(prices.loc[first:middle].index)
+    assert mirror.endpoint.calls == [(first, middle)]
+
+    extended = mirror.get_stock_data('TEST', prices.index[0], last)
+    assert extended.index.equals(prices.loc[:last].index)
+    pd.testing.assert_series_equal(extended['Close'], prices.loc[:last, 'Close'], check_names=False, check_freq=False)
+    assert mirror.endpoint.calls[1:] == [(prices.index[0], first - pd.Timedelta(days=1)),
+                                         (middle + pd.Timedelta(days=1), last)]
+
+    mirror.get_stock_data('TEST', prices.index[20], prices.index[150])
+    assert len(mirror.endpoint.calls) == 3
+
+
+@pytest.mark.parametrize('to_date', [None, 'future'])
+def test_top_up_fetches_today_again(mirror, to_date):
+    today = pd.Timestamp.today().normalize()
+    if to_date == 'future':
+        to_date = today + pd.Timedelta(days=30)
+    start = mirror.endpoint.prices.index[250]
+
+    first = mirror.get_stock_data('TEST', start, to_date)
+    assert first.index[-1] == today
+    mirror.get_stock_data('TEST', start, to_date)
+    assert mirror.endpoint.calls == [(start, today), (today, today)]
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from PortfolioBasic.Definitions import HeaderFactory
+from PortfolioBasic.Technical.Indicators import MomentumIndicator, BollingerIndicator, MACDIndicator, \
+    CommodityChannelIndex, AverageDirectionalIndex, TripleExponentialMovingAverage, AverageTrueRange, RsiIndicator, \
+    Williams, BetaIndicator
+from PortfolioBasic.Technical.Panel import MarketPanel
+from conftest import make_prices
+
+
+def indicators(benchmark):
+    return [MomentumIndicator(5), BollingerIndicator(), MACDIndicator(), CommodityChannelIndex(),
+            AverageDirectionalIndex(), TripleExponentialMovingAverage(), AverageTrueRange(), RsiIndicator(),
+            Williams(), BetaIndicator(benchmark, 20)]
+
+
+def assert_panel_matches_single(frames, benchmark):
+    panel = MarketPanel.from_frames(frames)
+    for indicator in indicators(benchmark):
+        result = indicator.calculate_panel(panel)
+        for ticker, frame in frames.items():
+            expected = indicator.calculate(frame)
+            for column in expected.columns:
+                values = result[column][ticker]
+                # no values on the dates the ticker does not trade
+                assert values.drop(frame.index).isnull().all()
+                np.testing.assert_allclose(values.reindex(frame.index).values,
+                                           expected[column].values.astype(np.float64), rtol=1e-7, atol=1e-9,
+                                           err_msg='{} {}'.format(ticker, column))
+
+
+@pytest.fixture
+def benchmark():
+    return make_prices(400, seed=3)[HeaderFactory.Price]
+
+
+def test_panel_matches_single_ticker_after_listing_date(benchmark):
+    listed_later = make_prices(250, seed=1, start='2011-06-01')
+    assert_panel_matches_single({'A': make_prices(400), 'B': listed_later}, benchmark)
+
+
+def test_panel_matches_single_ticker_on_different_calendars(benchmark):
+    prices = make_prices(400, seed=1)
+    # B does not trade on some of A's dates
+    holidays = prices.index[[30, 31, 120, 250]]
+    assert_panel_matches_single({'A': make_prices(400), 'B': prices.drop(holidays)}, benchmark)
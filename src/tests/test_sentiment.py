@@ -0,0 +1,84 @@
+import io
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from SentimentData import DailySentiment
+
+HEADER = 'Id,Date,Original,Calculated,TotalSentimentWords,Anger,Anticipation,Disgust,Fear,Joy,Sadness,Surprise,' \
+         'Trust,TotalWords\n'
+
+
+def article(number: int) -> str:
+    date = pd.Timestamp('2011-04-01 09:30') + pd.Timedelta(hours=7 * number)
+    return '{},{},5,{},10,{},1,2,3,4,5,6,7,{}\n'.format(number, date.strftime('%d/%m/%Y %H:%M:%S'),
+                                                       1 + number % 4, number % 3, 50 + number)
+
+
+def expected(content: str) -> pd.DataFrame:
+    """Daily means of all articles read at once, as the former read_csv aggregation."""
+    articles = pd.read_csv(io.StringIO(content))
+    articles.index = pd.to_datetime(articles['Date'], format=DailySentiment.DATE_FORMAT).dt.floor('D')
+    values = pd.DataFrame({'Calculated': ((articles['Calculated'] - 1) / 2) - 1})
+    for emotion in DailySentiment.EMOTIONS:
+        values[emotion] = articles[emotion] / articles['TotalWords']
+    means = values.groupby(level=0).mean()
+    return means.reindex(pd.date_range(means.index.min(), means.index.max(), freq='D'))
+
+
+def assert_means(sentiment, content):
+    np.testing.assert_allclose(sentiment.means().values, expected(content).values, rtol=1e-12)
+
+
+@pytest.fixture
+def location(tmp_path):
+    return str(tmp_path / 'articles.csv')
+
+
+def test_appended_articles_are_aggregated(location):
+    content = HEADER + ''.join(article(number) for number in range(10))
+    with open(location, 'w') as stream:
+        stream.write(content)
+    sentiment = DailySentiment(location, block_bytes=64)
+    assert sentiment.update() == 10
+    assert_means(sentiment, content)
+
+    appended = ''.join(article(number) for number in range(10, 25))
+    with open(location, 'a') as stream:
+        stream.write(appended)
+    assert sentiment.update() == 15
+    assert sentiment.update() == 0
+    assert_means(sentiment, content + appended)
+
+
+def test_last_line_without_newline_is_counted(location):
+    content = HEADER + ''.join(article(number) for number in range(5)) + article(5).rstrip('\n')
+    with open(location, 'w') as stream:
+        stream.write(content)
+    sentiment = DailySentiment(location)
+    sentiment.update()
+    assert_means(sentiment, content)
+    # reading again does not count the line twice
+    sentiment.update()
+    assert_means(sentiment, content)
+
+    # the line is completed and more articles follow
+    with open(location, 'a') as stream:
+        stream.write('\n' + article(6))
+    sentiment.update()
+    assert_means(sentiment, content + '\n' + article(6))
+
+
+def test_incomplete_last_line_is_read_once_complete(location):
+    line = article(3)
+    with open(location, 'w') as stream:
+        stream.write(HEADER + article(0) + article(1) + line[:12])
+    sentiment = DailySentiment(location)
+    sentiment.update()
+    assert_means(sentiment, HEADER + article(0) + article(1))
+
+    with open(location, 'a') as stream:
+        stream.write(line[12:])
+    sentiment.update()
+    assert_means(sentiment, HEADER + article(0) + article(1) + line)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from DataLoader import DataLoader
+from PortfolioBasic.Definitions import HeaderFactory
+from PortfolioBasic.Technical.Indicators import Indicator, BetaIndicator, MomentumIndicator, RsiIndicator, Williams
+from conftest import make_prices
+
+
+@pytest.fixture
+def benchmark(prices):
+    # Bloomberg benchmark files have UTC dates, the equities naive ones
+    close = make_prices(len(prices), seed=1)[HeaderFactory.Price]
+    close.index = close.index.tz_localize('UTC')
+    return close
+
+
+def test_beta_updates_match_calculate(prices, benchmark):
+    indicator = BetaIndicator(benchmark, windows=20)
+    expected = indicator.calculate(prices)
+
+    rows = [indicator.update(bar) for _, bar in prices.iterrows()]
+    streamed = pd.DataFrame(rows)
+    np.testing.assert_allclose(streamed.values, expected.values, rtol=1e-8, atol=1e-10)
+    assert streamed.index.equals(expected.index)
+
+
+def test_beta_prime_matches_calculate(prices, benchmark):
+    indicator = BetaIndicator(benchmark, windows=20)
+    expected = indicator.calculate(prices)
+
+    last = indicator.prime(prices.iloc[:-1])
+    np.testing.assert_allclose(last.values, expected.iloc[-2].values, rtol=1e-8)
+    np.testing.assert_allclose(indicator.update(prices.iloc[-1]).values, expected.iloc[-1].values, rtol=1e-8)
+
+
+def test_beta_update_needs_dated_bars(benchmark):
+    with pytest.raises(ValueError):
+        BetaIndicator(benchmark).update({'Close': 1.0})
+
+
+def test_streaming_with_benchmark(prices, benchmark):
+    # the combination DataLoader.load_data builds when given a benchmark
+    indicator = DataLoader().create_indicator((MomentumIndicator(1), RsiIndicator(), Williams(),
+                                               BetaIndicator(benchmark, 20)))
+    expected = indicator.calculate(prices)
+
+    indicator.prime(prices.iloc[:-5])
+    for date, bar in prices.iloc[-5:].iterrows():
+        row = indicator.update(bar)
+        assert row.name == date
+        np.testing.assert_allclose(row[expected.columns].values.astype(np.float64), expected.loc[date].values,
+                                   rtol=1e-6)
+
+
+def test_indicator_without_state_can_not_be_created():
+    class Partial(Indicator):
+
+        def required_days(self) -> int:
+            return 1
+
+        def calculate(self, data):
+            return data
+
+        def calculate_panel(self, panel):
+            return {}
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_beta_updates_match_calculate_with_missing_dates(prices, benchmark):
+    # the ticker does not trade on some of the benchmark's dates
+    prices = prices.drop(prices.index[[40, 41, 90]])
+    indicator = BetaIndicator(benchmark, windows=20)
+    expected = indicator.calculate(prices)
+
+    streamed = pd.DataFrame([indicator.update(bar) for _, bar in prices.iterrows()])
+    np.testing.assert_allclose(streamed.values, expected.values, rtol=1e-8, atol=1e-10)
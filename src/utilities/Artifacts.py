@@ -0,0 +1,80 @@
+import os
+import queue
+import threading
+import time
+from os import path
+
+import pandas as pd
+
+from utilities import Constants, logger
+
+
+class ArtifactSink(object):
+    """Receives the intermediate frames dumped for debugging, the default one drops them.
+
+    Frames may be passed as callables, the default sink never builds them.
+    """
+
+    def write(self, name: str, frame):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BackgroundArtifactSink(ArtifactSink):
+    """Pickles the frames on a background thread, so the caller does not wait for the disk.
+
+    `write` builds a callable frame and copies it in the caller's thread, the snapshot has to be
+    taken before the caller changes its frames. Only pickling and writing run in the background.
+    Every `write` of a name replaces the previous file, as the CSV dumps did. `flush` waits
+    until everything queued so far is on disk.
+    """
+
+    EXTENSION = '.pkl'
+
+    def __init__(self, location: str = Constants.ARTIFACTS, max_queued: int = 16):
+        self.location = location
+        self.written = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = threading.Thread(target=self._run, name='artifact-sink', daemon=True)
+        self._thread.start()
+
+    def write(self, name: str, frame):
+        if callable(frame):
+            frame = frame()
+        # snapshot, the caller is free to keep modifying its frame
+        self._queue.put((name, frame.copy()))
+
+    def flush(self):
+        self._queue.join()
+
+    def close(self):
+        self.flush()
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._store(*item)
+            except Exception:
+                logger.exception("Failed to write artifact [%s]", item[0])
+            finally:
+                self._queue.task_done()
+
+    def _store(self, name: str, frame: pd.DataFrame):
+        os.makedirs(self.location, exist_ok=True)
+        file_name = path.join(self.location, name + self.EXTENSION)
+        temp_name = '{}.{}.tmp'.format(file_name, threading.get_ident())
+        start = time.time()
+        frame.to_pickle(temp_name)
+        os.replace(temp_name, file_name)
+        self.written += 1
+        logger.debug("Artifact [%s] written in %.3fs", file_name, time.time() - start)
@@ -11,5 +11,13 @@ DATASETS_MARKET = path.join(DATASETS, 'Market')
 
 PROCESSED_LEXICONS = path.join(DATASETS, 'lexicons/')
 
+INDICATOR_CACHE = path.join(TEMP, 'market-wisdom', 'indicators')
+
+FRAME_CACHE = path.join(TEMP, 'market-wisdom', 'frames')
+
+QUANDL_MIRROR = path.join(TEMP, 'market-wisdom', 'quandl')
+
+ARTIFACTS = path.join(TEMP, 'market-wisdom', 'artifacts')
+
 TRAINING_BATCH = 10
 TESTING_BATCH = 10
@@ -12,6 +12,8 @@ from os import path, walk, makedirs
 from utilities import Constants, logger
 import io
 
+from PortfolioBasic.Instrumentation import tracer
+
 from utilities.NumpyHelper import NumpyDynamic
 
 
@@ -54,6 +56,7 @@ class DataIterator(object):
             logger.info('Deleting [%s] cache dir', self.bin_location)
             shutil.rmtree(self.bin_location)
 
+    @tracer.traced('DataIterator.get_data')
     def get_data(self):
         all_data_path = path.join(self.bin_location, 'all')
         if not Path(all_data_path).exists():
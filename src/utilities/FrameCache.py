@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import tempfile
+from os import path
+
+import numpy as np
+import pandas as pd
+
+from utilities import Constants, logger
+
+
+class FrameCache(object):
+    """Memory-mappable binary copies of data frames parsed from source files.
+
+    Each entry holds the values as one column-major float64 `.npy` matrix, the index as int64
+    nanoseconds and a small JSON header. An entry is only used while the source file keeps the
+    modification time and size it had when the entry was written.
+    """
+
+    def __init__(self, location: str = Constants.FRAME_CACHE):
+        self.location = location
+
+    def _base(self, source_file: str, variant: str):
+        digest = hashlib.sha1('{}|{}'.format(path.abspath(source_file), variant).encode('utf-8')).hexdigest()
+        return path.join(self.location, digest)
+
+    @staticmethod
+    def files(base: str):
+        return base + '.json', base + '.values.npy', base + '.index.npy'
+
+    @staticmethod
+    def _signature(source_file: str) -> dict:
+        info = os.stat(source_file)
+        return {'mtime': info.st_mtime_ns, 'size': info.st_size}
+
+    def load(self, source_file: str, parse, variant: str = '') -> pd.DataFrame:
+        """Return the frame cached for `source_file`, calling `parse()` to rebuild a stale entry.
+
+        `variant` separates entries parsed differently from the same file.
+        """
+        frame = self.get(source_file, variant)
+        if frame is None:
+            frame = parse()
+            self.put(source_file, variant, frame)
+        return frame
+
+    def get(self, source_file: str, variant: str = ''):
+        header = self.read_header(self._base(source_file, variant))
+        if header is None or header.get('source') != self._signature(source_file):
+            return None
+        frame = self.read(self._base(source_file, variant), header)
+        if frame is None:
+            logger.warning("Ignoring unreadable cache entry for [%s]", source_file)
+        return frame
+
+    def put(self, source_file: str, variant: str, frame: pd.DataFrame):
+        if not self.write(self._base(source_file, variant), frame, {'source': self._signature(source_file)}):
+            logger.debug("Frame of [%s] is not numeric, not cached", source_file)
+
+    @staticmethod
+    def read_header(base: str):
+        header_file = FrameCache.files(base)[0]
+        if not path.exists(header_file):
+            return None
+        try:
+            with open(header_file) as stream:
+                return json.load(stream)
+        except (IOError, ValueError):
+            return None
+
+    @staticmethod
+    def read(base: str, header: dict = None):
+        """Map the frame stored at `base`, None if it is missing or unreadable."""
+        if header is None:
+            header = FrameCache.read_header(base)
+            if header is None:
+                return None
+        _, values_file, index_file = FrameCache.files(base)
+        try:
+            # copy-on-write map, callers may modify the frame without touching the stored copy
+            values = np.load(values_file, mmap_mode='c')
+            index = pd.DatetimeIndex(np.load(index_file).view('datetime64[ns]'), name=header['index_name'])
+        except (IOError, ValueError, KeyError):
+            return None
+        if header['tz'] is not None:
+            index = index.tz_localize('UTC').tz_convert(header['tz'])
+        return pd.DataFrame(values, index=index, columns=header['columns'], copy=False)
+
+    @staticmethod
+    def write(base: str, frame: pd.DataFrame, extra: dict = None) -> bool:
+        """Store a numeric, date indexed frame at `base` with `extra` added to its header."""
+        if not isinstance(frame.index, pd.DatetimeIndex):
+            return False
+        try:
+            values = np.asfortranarray(frame.values, dtype=np.float64)
+        except (TypeError, ValueError):
+            return False
+        os.makedirs(path.dirname(base), exist_ok=True)
+
+        header_file, values_file, index_file = FrameCache.files(base)
+        tz = None if frame.index.tz is None else str(frame.index.tz)
+        index = frame.index if frame.index.tz is None else frame.index.tz_convert('UTC').tz_localize(None)
+        header = dict(extra or {})
+        header.update({
+            'columns': [str(column) for column in frame.columns],
+            'index_name': frame.index.name,
+            'tz': tz
+        })
+        # header goes last, a half written entry is never picked up
+        FrameCache._write(values_file, lambda stream: np.save(stream, values))
+        FrameCache._write(index_file, lambda stream: np.save(stream, index.values.view('int64')))
+        FrameCache._write(header_file, lambda stream: stream.write(json.dumps(header).encode('utf-8')))
+        return True
+
+    @staticmethod
+    def _write(file_name, writer):
+        handle, temp_name = tempfile.mkstemp(suffix='.tmp', dir=path.dirname(file_name))
+        try:
+            with os.fdopen(handle, 'wb') as stream:
+                writer(stream)
+            os.replace(temp_name, file_name)
+        except Exception:
+            os.remove(temp_name)
+            raise
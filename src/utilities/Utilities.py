@@ -3,10 +3,8 @@ import json
 from os import path
 
 import _pickle as cPickle
-from sklearn import metrics
 
 import numpy as np
-from sklearn.metrics import roc_auc_score
 
 from utilities import logger
 
@@ -77,6 +75,8 @@ class Utilities(object):
 
     @staticmethod
     def measure_performance(test_y, result_y):
+        # sklearn is slow to import, only load it when results are measured
+        from sklearn import metrics
         report = metrics.classification_report(test_y, result_y, digits=3)
         logger.info('\n{}'.format(report))
 
@@ -89,11 +89,12 @@ class Utilities(object):
 
     @staticmethod
     def measure_performance_auc(test_y, result_y, result_y_prob):
+        from sklearn import metrics
         try:
             vacc = metrics.accuracy_score(test_y, result_y)
             # find validation AUC
             if len(np.unique(test_y)) == 2:
-                vauc = roc_auc_score(test_y, result_y_prob)
+                vauc = metrics.roc_auc_score(test_y, result_y_prob)
                 logger.info('Accurary: {0:.3f} and AUC {1:.3f}'.format(vacc, vauc))
             else:
                 vauc = None